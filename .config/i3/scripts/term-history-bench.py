@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Terminal History Menu Benchmarks
+Synthetic fish/zsh/bash histories to time the term-history.py parse and render paths
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+import importlib.util
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent / 'term-history.py'
+LAUNCHER = SCRIPT.with_name('term-history-launch.py')
+STARTUP_BUDGET_MS = 30  # Key press to rofi exit through the launcher and a running daemon
+FALLBACK_BUDGET_MS = 120  # The same without a daemon, with a warm cache, measured at ~70 ms
+
+HISTORY_PATHS = {
+    'fish': '.local/share/fish/fish_history',
+    'zsh': '.zsh_history',
+    'bash': '.bash_history',
+}
+
+class HistoryGenerator:
+    """Writes realistic history files with a configurable share of repeated commands"""
+    PROGRAMS = {
+        'git': ['status', 'diff', 'add -p', 'commit -m "wip"', 'checkout -b feature/{n}', 'push origin HEAD',
+                'log --oneline -20', 'rebase -i HEAD~{n}', 'stash pop'],
+        'docker': ['ps -a', 'compose up -d', 'logs -f app-{n}', 'exec -it app-{n} sh', 'build -t img:{n} .'],
+        'kubectl': ['get pods -n ns-{n}', 'describe pod web-{n}', 'logs deploy/api-{n} --tail=100'],
+        'cd': ['~/projects/repo-{n}', '..', '/etc/nginx', '-'],
+        'nvim': ['src/main-{n}.rs', '~/.config/i3/config', 'README.md'],
+        'ls': ['-la', '-lh ~/Downloads', ''],
+        'curl': ['-s https://api.example.com/v{n}/items | jq .', '-I https://example.org/{n}'],
+        'cargo': ['build --release', 'test -- --nocapture', 'run --bin tool-{n}'],
+        'ssh': ['host-{n}', 'deploy@10.0.0.{n}'],
+    }
+    MULTILINE_SHARE = 0.02  # Share of zsh entries written with backslash continuations
+    PATHS_SHARE = 0.3  # Share of fish entries carrying a paths: block
+
+    def __init__(self, duplicate_ratio: float = 0.6, seed: int = 1):
+        self.duplicate_ratio = duplicate_ratio
+        self.random = random.Random(seed)
+        self.recent = []
+
+    def command(self) -> str:
+        if self.recent and self.random.random() < self.duplicate_ratio:
+            # Repeats favour recently used commands, like real shells
+            return self.recent[-1 - min(int(self.random.expovariate(0.05)), len(self.recent) - 1)]
+        program = self.random.choice(list(self.PROGRAMS))
+        args = self.random.choice(self.PROGRAMS[program]).format(n=self.random.randint(0, 10 ** 6))
+        command = f"{program} {args}".strip()
+        self.recent.append(command)
+        if len(self.recent) > 4096:
+            del self.recent[:2048]
+        return command
+
+    def write(self, shell: str, path: Path, entries: int, start: int = 1_600_000_000):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        timestamp = start
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(entries):
+                timestamp += self.random.randint(1, 120)
+                command = self.command()
+                if shell == 'fish':
+                    f.write(f"- cmd: {command}\n  when: {timestamp}\n")
+                    if self.random.random() < self.PATHS_SHARE:
+                        f.write(f"  paths:\n    - ~/projects/repo-{self.random.randint(0, 50)}\n")
+                elif shell == 'zsh':
+                    if self.random.random() < self.MULTILINE_SHARE:
+                        command = f"for f in *.log; do\\\n  gzip \"$f\"\\\ndone # {timestamp}"
+                    f.write(f": {timestamp}:0;{command}\n")
+                else:
+                    f.write(f"{command}\n")
+
+def parse_size(text: str) -> int:
+    """10k -> 10000, 1M -> 1000000"""
+    text = text.strip().lower()
+    scale = {'k': 10 ** 3, 'm': 10 ** 6}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+def load_module():
+    spec = importlib.util.spec_from_file_location('term_history', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # Lets the parallel parser pickle its worker function
+    spec.loader.exec_module(module)
+    return module
+
+def peak_rss_mb() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_worker(max_commands: int) -> dict:
+    """Measure one history in a fresh process; HOME and XDG dirs are set by the parent"""
+    import time
+    started = time.perf_counter()
+    module = load_module()
+    result = {'import_ms': (time.perf_counter() - started) * 1000}
+
+    # Cold start, newest first: how long until rofi would get its first batch. Line
+    # numbers count from the oldest entry, so only an unnumbered menu streams.
+    menu = module.RofiHistoryMenu(use_daemon=False, sort='recent', show_line_numbers=False)
+    menu.MAX_COMMANDS = max_commands
+    started = time.perf_counter()
+    stream = menu.stream_entries()
+    next(stream, None)
+    result['first_line_ms'] = (time.perf_counter() - started) * 1000
+    for _ in stream:
+        pass
+    result['menu_cold_ms'] = (time.perf_counter() - started) * 1000
+
+    manager = module.HistoryManager()
+    started = time.perf_counter()
+    manager.load_history(max_commands)
+    result['menu_warm_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for row in manager.ordered('frecency'):
+        manager.format_command_for_rofi(manager.store, row)
+    result['format_ms'] = (time.perf_counter() - started) * 1000
+
+    manager = module.HistoryManager()
+    started = time.perf_counter()
+    manager.load_history(0)
+    result['full_parse_ms'] = (time.perf_counter() - started) * 1000
+    result['unique'] = len(manager.store)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+class Benchmark:
+    COLUMNS = ['first_line_ms', 'menu_cold_ms', 'menu_warm_ms', 'format_ms', 'full_parse_ms', 'peak_rss_mb']
+
+    def __init__(self, shells, sizes, duplicate_ratio: float, max_commands: int, workdir: Path, repeat: int = 3):
+        self.shells = shells
+        self.sizes = sizes
+        self.duplicate_ratio = duplicate_ratio
+        self.max_commands = max_commands
+        self.workdir = workdir
+        self.repeat = repeat
+
+    def run_case(self, shell: str, size: int) -> dict:
+        home = self.workdir / f"{shell}-{size}"
+        history = home / HISTORY_PATHS[shell]
+        if not history.exists():
+            HistoryGenerator(self.duplicate_ratio).write(shell, history, size)
+        cache = home / 'cache'
+        env = dict(os.environ, HOME=str(home), SHELL=f"/usr/bin/{shell}",
+                   XDG_CACHE_HOME=str(cache), XDG_RUNTIME_DIR=str(home))
+        # Best of several fresh processes keeps scheduler noise out of --compare
+        result = None
+        for _ in range(self.repeat):
+            shutil.rmtree(cache, ignore_errors=True)
+            process = subprocess.run([sys.executable, __file__, '--worker', '--max-commands', str(self.max_commands)],
+                                     env=env, capture_output=True, text=True, check=True)
+            run = json.loads(process.stdout)
+            result = run if result is None else {key: min(value, run[key]) for key, value in result.items()}
+        result.update(shell=shell, entries=size, size_mb=history.stat().st_size / 2 ** 20)
+        return result
+
+    def run(self) -> list:
+        results = []
+        print(f"{'case':<14}{'MB':>8}{'unique':>10}" + ''.join(f"{column:>15}" for column in self.COLUMNS))
+        for size in self.sizes:
+            for shell in self.shells:
+                result = self.run_case(shell, size)
+                results.append(result)
+                print(f"{shell + ' ' + str(size):<14}{result['size_mb']:>8.1f}{result['unique']:>10}"
+                      + ''.join(f"{result[column]:>15.1f}" for column in self.COLUMNS), flush=True)
+        return results
+
+def startup(workdir: Path, runs: int, budget: float) -> int:
+    """Time the menu from launch to exit against a rofi that cancels at once; returns 1 over budget
+
+    The launcher is timed against a running daemon (held to budget) and on its
+    own (held to FALLBACK_BUDGET_MS); a bare interpreter start is shown for scale.
+    """
+    import time
+    import statistics
+    home = workdir / 'startup'
+    HistoryGenerator().write('zsh', home / HISTORY_PATHS['zsh'], 10_000)
+    bin_dir = home / 'bin'
+    bin_dir.mkdir()
+    rofi = bin_dir / 'rofi'
+    rofi.write_text('#!/bin/sh\ncat >/dev/null\nexit 1\n')
+    rofi.chmod(0o755)
+    runtime = home / 'run'
+    runtime.mkdir(mode=0o700)  # The daemon only serves from a directory private to its user
+    env = dict(os.environ, HOME=str(home), SHELL='/usr/bin/zsh', XDG_CACHE_HOME=str(home / 'cache'),
+               XDG_RUNTIME_DIR=str(runtime), PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    env.pop('PYTHONDONTWRITEBYTECODE', None)  # The launcher relies on cached bytecode
+
+    def median(name: str, argv: list) -> float:
+        timings = []
+        for i in range(runs + 1):
+            started = time.perf_counter()
+            subprocess.run(argv, env=env, check=True)
+            if i:  # The first run fills the caches
+                timings.append((time.perf_counter() - started) * 1000)
+        result = statistics.median(timings)
+        print(f"{name:<34}{result:>8.1f} ms median over {runs} warm starts")
+        return result
+
+    bare = median('python -c pass', [sys.executable, '-c', 'pass'])
+    median(SCRIPT.name, [sys.executable, str(SCRIPT), '--no-daemon'])
+    fallback = median(f"{LAUNCHER.name} --no-daemon", [sys.executable, str(LAUNCHER), '--no-daemon'])
+
+    daemon = subprocess.Popen([sys.executable, str(SCRIPT), '--daemon'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        socket_path = runtime / 'term-history.sock'
+        deadline = time.monotonic() + 30
+        while not socket_path.exists() and time.monotonic() < deadline and daemon.poll() is None:
+            time.sleep(0.05)
+        served = median(f"{LAUNCHER.name} (daemon)", [sys.executable, str(LAUNCHER)])
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+    print(f"{'':<34}{served - bare:>8.1f} ms of it beyond the bare interpreter")
+    ok = True
+    for name, result, limit in (('daemon', served, budget), ('fallback', fallback, FALLBACK_BUDGET_MS)):
+        within = result <= limit
+        ok = ok and within
+        print(f"{'✅' if within else '❌'} {name} budget {limit:.0f} ms")
+    return 0 if ok else 1
+
+def compare(results: list, baseline_file: Path, tolerance: float) -> int:
+    """Print cases slower than the baseline by more than tolerance; returns the count"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = {(r['shell'], r['entries']): r for r in json.load(f)}
+    regressions = 0
+    for result in results:
+        before = baseline.get((result['shell'], result['entries']))
+        if not before:
+            continue
+        for column in Benchmark.COLUMNS:
+            if before[column] > 0 and result[column] > before[column] * (1 + tolerance):
+                regressions += 1
+                print(f"❌ {result['shell']} {result['entries']}: {column} "
+                      f"{before[column]:.1f} -> {result[column]:.1f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='⏱ Benchmark term-history.py on synthetic histories',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                                  # fish, zsh and bash at 10k and 100k entries
+  %(prog)s --sizes 10k,1M,10M --shells zsh  # Large zsh histories only
+  %(prog)s --save baseline.json             # Record a baseline
+  %(prog)s --compare baseline.json          # Exit non-zero on a >20%% slowdown
+  %(prog)s --startup                        # Check warm menu start with and without a daemon
+        """
+    )
+    parser.add_argument('--shells', default='fish,zsh,bash', help='Comma-separated shells (default: all)')
+    parser.add_argument('--sizes', default='10k,100k', help='Comma-separated entry counts, e.g. 10k,1M,10M')
+    parser.add_argument('--duplicates', type=float, default=0.6, metavar='RATIO',
+                       help='Share of entries repeating an earlier command (default: 0.6)')
+    parser.add_argument('--max-commands', type=int, default=1000, help='Menu size to load (default: 1000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case, best time kept (default: 3)')
+    parser.add_argument('--workdir', type=Path, help='Keep generated histories here for reuse')
+    parser.add_argument('--save', type=Path, metavar='FILE', help='Write results as JSON')
+    parser.add_argument('--compare', type=Path, metavar='FILE', help='Compare against saved results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown for --compare')
+    parser.add_argument('--startup', action='store_true',
+                       help='Time menu start via term-history-launch.py, with a daemon against --budget, and exit')
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_MS, metavar='MS',
+                       help=f'Startup budget through the daemon for --startup (default: {STARTUP_BUDGET_MS} ms; '
+                            f'{FALLBACK_BUDGET_MS} ms without one)')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.max_commands)))
+        return 0
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix='term-history-bench-'))
+    if args.startup:
+        try:
+            return startup(workdir, max(args.repeat, 5), args.budget)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+    try:
+        benchmark = Benchmark(args.shells.split(','), [parse_size(size) for size in args.sizes.split(',')],
+                              args.duplicates, args.max_commands, workdir, args.repeat)
+        results = benchmark.run()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\n🚫 Cancelled by user")
+        sys.exit(130)
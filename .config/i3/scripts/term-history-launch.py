@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Rofi Terminal History Menu launcher
+With a running `term-history.py --daemon`, this is the whole menu for Enter and
+Alt+C: it asks the daemon for the rofi command line and the rendered rows (the
+commands used in the focused terminal's directory first), feeds them to rofi
+and copies (and types) the chosen command. It goes through _socket and
+os.posix_spawnp, as importing socket and subprocess alone takes longer than the
+rest of the run. Arguments, other keys or no daemon hand over to term-history.py,
+run from cached bytecode so each key press skips compiling it.
+"""
+
+import time
+STARTED = time.monotonic()
+
+import os
+import sys
+import _socket
+
+SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'term-history.py')
+PYCACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'term-history', 'pycache')
+# As in term-history.py: $XDG_RUNTIME_DIR, else a 0700 directory per user
+SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+    os.environ.get('TMPDIR') or '/tmp', f'term-history-{os.getuid()}'), 'term-history.sock')
+SORT = 'frecency'  # term-history.py's default order
+RESUMED = (10, 11, 13, 14, 15, 16, 17)  # Edit, run in terminal, help and toggles need the full menu
+NEEDS_COMMAND = (10, 11)
+
+def load():
+    """Import term-history.py, compiling it only when the source changed"""
+    from importlib.machinery import SourceFileLoader
+    loader = SourceFileLoader('term_history', SCRIPT)
+    sys.pycache_prefix = PYCACHE  # Keep the .pyc out of the dotfiles tree
+    try:
+        code = loader.get_code('term_history')
+    finally:
+        sys.pycache_prefix = None
+    module = type(sys)('term_history')
+    module.__file__ = SCRIPT
+    module.__loader__ = loader
+    module.STARTED = STARTED  # So --trace counts the launcher too
+    sys.modules['term_history'] = module
+    exec(code, module.__dict__)
+    return module
+
+def request(line: str):
+    """A buffered reader on the daemon's answer to line"""
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.settimeout(0.5)
+        sock.connect(SOCKET_PATH)
+        # The reply is run (rofi and clipboard argv) and typed: only trust a daemon of this user
+        creds = sock.getsockopt(_socket.SOL_SOCKET, _socket.SO_PEERCRED, 12)  # struct ucred: pid, uid, gid
+        if int.from_bytes(creds[4:8], sys.byteorder) != os.getuid():
+            raise PermissionError(f"{SOCKET_PATH} is served by another user")
+        sock.settimeout(None)
+        sock.sendall(line.encode('utf-8') + b'\n')
+    except OSError:
+        sock.close()
+        raise
+    return open(sock.detach(), 'rb')
+
+def fetch_command(generation: str, context: list, index: str) -> str:
+    """The command behind a row, empty if the daemon no longer knows it"""
+    if not index.isdigit():
+        return ''
+    if int(index) < len(context):
+        return context[int(index)]
+    try:
+        with request(f"command {generation} {SORT} {int(index) - len(context)}") as rfile:
+            return rfile.read().decode('utf-8')
+    except OSError:
+        return ''
+
+def start(argv: list, stdin: int = -1, stdout: int = -1, detached: bool = False) -> int:
+    """Spawn argv with the given pipe ends as stdin and stdout (else /dev/null); returns the pid"""
+    actions = [(os.POSIX_SPAWN_DUP2, fd, target) if fd >= 0 else (os.POSIX_SPAWN_OPEN, target, os.devnull, os.O_RDWR, 0)
+               for fd, target in ((stdin, 0), (stdout, 1), (-1, 2))]
+    return os.posix_spawnp(argv[0], argv, os.environ, file_actions=actions, setsid=detached)
+
+def spawn(argv: list) -> bool:
+    """Start argv detached, so the launcher can exit without waiting for it"""
+    try:
+        start(argv, detached=True)
+        return True
+    except OSError:
+        return False
+
+def wait(pid: int) -> int:
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def copy(clipboard: list, text: str) -> bool:
+    read_end, write_end = os.pipe()
+    try:
+        pid = start(clipboard, stdin=read_end)
+    except OSError:
+        return False
+    finally:
+        os.close(read_end)
+    try:
+        with open(write_end, 'wb') as f:
+            f.write(text.encode('utf-8'))
+    except BrokenPipeError:
+        pass
+    return wait(pid) == 0
+
+def serve_menu():
+    """Run the menu on the daemon's rows; returns an exit code, or term-history.py arguments to hand over with"""
+    try:
+        rfile = request(f"menu {SORT} 1 1")
+    except OSError:
+        return []  # No daemon
+    with rfile:
+        header = rfile.readline().split()
+        if len(header) != 6 or header[0] != b'ok':
+            return []
+        generation = header[1].decode()
+        rofi, clipboard, context = (rfile.read(int(size)).decode('utf-8').split('\0') if int(size) else []
+                                    for size in header[3:])
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        try:
+            pid = start(rofi, stdin=stdin_read, stdout=stdout_write)
+        except OSError:
+            return []  # term-history.py reports it
+        finally:
+            os.close(stdin_read)
+            os.close(stdout_write)
+        try:
+            with open(stdin_write, 'wb') as stdin:
+                for chunk in iter(lambda: rfile.read1(65536), b''):
+                    stdin.write(chunk)
+                    stdin.flush()
+        except BrokenPipeError:
+            pass  # rofi exited before reading everything
+    with open(stdout_read, 'rb') as stdout:
+        selection = stdout.read().decode('utf-8', errors='ignore').rstrip('\n')
+    returncode = wait(pid)
+
+    # Values go after '=' so argparse takes them verbatim, leading dashes and all
+    resume = [f"--resume={returncode} {selection}"]
+    if returncode in RESUMED:
+        if returncode in NEEDS_COMMAND:
+            resume.append(f"--resume-command={fetch_command(generation, context, selection.partition(' ')[0])}")
+        return resume
+    if returncode not in (0, 12):
+        return returncode if returncode != 1 else 0
+    command = fetch_command(generation, context, selection.partition(' ')[0])
+    if not command or not clipboard:
+        return resume  # Let the full menu report it
+    if not copy(clipboard, command):
+        wait(start(['rofi', '-e', '❌']))
+        return 0
+    typed = returncode == 0 and spawn(['xdotool', 'key', 'ctrl+v', command])
+    spawn(['notify-send', 'History Menu', 'Executed' if typed else 'Copied'])
+    return 0
+
+if __name__ == '__main__':
+    handover = serve_menu() if len(sys.argv) == 1 else []
+    if isinstance(handover, int):
+        sys.exit(handover)
+    sys.argv[1:1] = handover
+    sys.exit(load().launch())
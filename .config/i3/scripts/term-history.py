@@ -4,22 +4,1343 @@ Rofi Terminal History Menu
 A beautiful history browser using Rofi with search, edit, and clipboard integration
 """
 
+import time
+STARTED = globals().get('STARTED') or time.monotonic()  # Set earlier by term-history-launch.py
+
 import os
 import sys
 import subprocess
-import tempfile
 import json
+import math
+import zlib
+import bisect
+import heapq
+from array import array
+import mmap
+import select
+import socket
+import struct
+import threading
+import queue
+import itertools
+import contextlib
+import functools
 from pathlib import Path
-from datetime import datetime
 import re
 import argparse
-from typing import List, Dict, Optional
-import tailer
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
+IMPORTED = time.monotonic()
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'term-history'
+HISTORY_FILES = ['.local/share/fish/fish_history', '.zsh_history', '.bash_history', '.history']
+SORT_ORDERS = ('frecency', 'recent')
+# Per user: $XDG_RUNTIME_DIR is private already, elsewhere the daemon makes a 0700 directory of its own
+RUNTIME_DIR = (Path(os.environ['XDG_RUNTIME_DIR']) if os.environ.get('XDG_RUNTIME_DIR')
+               else Path(os.environ.get('TMPDIR') or '/tmp') / f'term-history-{os.getuid()}')
+SOCKET_PATH = RUNTIME_DIR / 'term-history.sock'
+TRACE_LOG = CACHE_DIR / 'trace.jsonl'
+IGNORE_FILE = Path(os.environ.get('XDG_CONFIG_HOME') or Path.home() / '.config') / 'term-history' / 'ignore'
+# Rules kept out of the menu before any in IGNORE_FILE: a literal drops the
+# command it names and any starting with those words; re: searches anywhere
+DEFAULT_IGNORE = (
+    # Trivial commands on their own
+    r're:^(?:ls|ll|la|cd|pwd|clear|exit|history|fg|bg|jobs)$',
+    # Secrets: auth headers, exported keys/tokens/passwords, password flags and well-known token shapes
+    r're:(?i:\b(?:authorization|proxy-authorization|x-api-key|private-token|cookie):)',
+    r're:(?i:\bexport\s+\w*(?:key|token|secret|passw(?:or)?d)\w*=)',
+    r're:(?i:--?(?:password|passwd|token|api-key)[= ]\S)',
+    r're:\b(?:gh[pousr]_\w{20,}|github_pat_\w{20,}|xox[abprs]-[\w-]{10,}|sk-[\w-]{20,}|AKIA[0-9A-Z]{16})',
+)
+
+class PhaseTracer:
+    """Monotonic per-phase timings of one run, appended as a JSON line when tracing is on"""
+    def __init__(self, log_file: Optional[Path] = None):
+        self.log_file = log_file
+        self.phases: Dict[str, float] = {}  # Phase -> milliseconds, summed over repeats
+
+    def add(self, name: str, started: float, finished: Optional[float] = None):
+        if self.log_file:
+            elapsed = ((finished or time.monotonic()) - started) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, started)
+
+    def write(self, **fields):
+        """Append this run to the log; tracing must never break the menu"""
+        if not self.log_file:
+            return
+        self.add('total', STARTED)
+        record = {'time': int(time.time()), **fields,
+                  'phases': {name: round(ms, 3) for name, ms in self.phases.items()}}
+        try:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError:
+            pass
+
+    @staticmethod
+    def summarize(log_file: Path) -> str:
+        """p50/p95 per phase over every run in the log"""
+        timings: Dict[str, List[float]] = {}
+        runs = 0
+        with open(log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    phases = json.loads(line)['phases']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                runs += 1
+                for name, ms in phases.items():
+                    timings.setdefault(name, []).append(ms)
+
+        def percentile(values: List[float], p: float) -> float:
+            return values[min(len(values) - 1, int(math.ceil(p * len(values))) - 1)]
+
+        lines = [f"{runs} runs in {log_file}", f"{'phase':<14}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for name, values in sorted(timings.items(), key=lambda item: -sorted(item[1])[len(item[1]) // 2]):
+            values.sort()
+            lines.append(f"{name:<14}{len(values):>6}{percentile(values, 0.5):>10.1f}"
+                         f"{percentile(values, 0.95):>10.1f}{values[-1]:>10.1f}")
+        return '\n'.join(lines)
+
+def traced(name: str):
+    """Time a method as phase name on its object's tracer"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+def private_dir(path: Path) -> bool:
+    """Whether path is a real directory that only this user can enter, creating it if missing"""
+    import stat
+    try:
+        path.mkdir(mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+def peer_uid(sock: socket.socket) -> int:
+    """uid of the process at the other end of a connected Unix socket"""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+def spawn(argv: List[str]) -> bool:
+    """Start argv detached, so the menu can exit without waiting for it"""
+    try:
+        subprocess.Popen(argv, start_new_session=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
+    except OSError:
+        return False
+
+def pango_escape(text: str) -> str:
+    """text as literal Pango markup, for rofi's -markup-rows"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def highlight(text: str, query: str) -> str:
+    """Pango-escaped text with the characters each query term fuzzily matched in bold"""
+    lowered, marked = text.lower(), set()
+    for term in query.lower().split():
+        found, position = [], 0
+        for char in term:
+            position = lowered.find(char, position)
+            if position < 0:
+                break
+            found.append(position)
+            position += 1
+        else:
+            marked.update(found)
+    parts, bold = [], False
+    for i, char in enumerate(text):
+        if (i in marked) != bold:
+            bold = not bold
+            parts.append('<b>' if bold else '</b>')
+        parts.append(pango_escape(char))
+    if bold:
+        parts.append('</b>')
+    return ''.join(parts)
+
+def shell_cwd(pid: int) -> Optional[str]:
+    """Working directory of the newest child of pid (the shell in a terminal), else of pid itself"""
+    children = []
+    try:
+        for task in os.scandir(f'/proc/{pid}/task'):
+            with open(f'{task.path}/children') as f:
+                children += map(int, f.read().split())
+    except OSError:
+        # No /proc/<pid>/task/<tid>/children in this kernel: find them by parent
+        for entry in os.scandir('/proc'):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry.name}/stat') as f:
+                    if int(f.read().rpartition(')')[2].split()[1]) == pid:
+                        children.append(int(entry.name))
+            except (OSError, ValueError, IndexError):
+                continue
+
+    def started(child: int) -> int:
+        try:
+            with open(f'/proc/{child}/stat') as f:
+                return int(f.read().rpartition(')')[2].split()[19])
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    for candidate in sorted(children, key=lambda child: (started(child), child), reverse=True) + [pid]:
+        try:
+            return os.readlink(f'/proc/{candidate}/cwd')
+        except OSError:
+            continue
+    return None
+
+def window_pid(window: Optional[str] = None) -> Optional[int]:
+    """PID of the X window with id window, by default of the focused one"""
+    argv = ['xdotool', 'getwindowpid', window] if window else ['xdotool', 'getactivewindow', 'getwindowpid']
+    try:
+        return int(subprocess.run(argv, capture_output=True, text=True, timeout=1).stdout)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+def focused_cwd() -> Optional[str]:
+    """Working directory of the shell in the focused window, found through the window's PID"""
+    pid = window_pid()
+    return shell_cwd(pid) if pid else None
+
+class HistoryCache:
+    """Parsed history persisted in the XDG cache dir, keyed by the history file's inode/size/mtime"""
+    VERSION = 4
+
+    def __init__(self, history_file: Path, max_commands: int):
+        digest = f"{zlib.crc32(str(history_file).encode()):08x}"  # zlib imports faster than hashlib
+        self.path = CACHE_DIR / f"{history_file.name}-{digest}-{max_commands or 'all'}.json"
+
+    def load(self) -> Optional[dict]:
+        """Return the cached state, or None if missing, corrupt or from another version"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if data.get('version') == self.VERSION else None
+
+    def save(self, data: dict):
+        """Atomically replace the cache file"""
+        import tempfile
+        data['version'] = self.VERSION
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=CACHE_DIR, suffix='.tmp', delete=False, encoding='utf-8') as f:
+                # dumps uses the C encoder; dump would iterate in Python
+                f.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                temp_file = f.name
+            os.replace(temp_file, self.path)
+        except OSError:
+            pass  # The cache is only an optimization
+
+class CommandTable:
+    """Unique commands in one UTF-8 blob, numbered in order of arrival
+
+    Lookup by command goes through an open-addressing table of row numbers
+    probed on each row's stored hash, so only rows whose hash matches are
+    decoded and neither a second copy of the strings nor a boxed int per
+    command is kept. Killed rows stay in place and are skipped by find(); the
+    table is rebuilt from the alive ones when it fills up, and after extend()
+    only once a lookup needs it.
+    """
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array('Q', [0])
+        self.hashes = array('q')
+        self.alive = bytearray()  # 1 per row, 0 once killed
+        self.live = 0
+        self.slots: Optional[array] = None  # Row numbers, -1 where empty; None until rebuilt
+        self.used = 0  # Slots holding a row, dead or alive
+
+    def append(self, command: str) -> int:
+        row = len(self.hashes)
+        key = hash(command)
+        self.blob += command.encode('utf-8')
+        self.offsets.append(len(self.blob))
+        self.hashes.append(key)
+        self.alive.append(1)
+        self.live += 1
+        slots = self.table()
+        if (self.used + 1) * 3 > len(slots) * 2:
+            slots = self.rehash()
+        mask = len(slots) - 1
+        slot = key & mask
+        while slots[slot] >= 0:
+            slot = (slot + 1) & mask
+        slots[slot] = row
+        self.used += 1
+        return row
+
+    def extend(self, commands: List[str]):
+        """Append many commands at once, e.g. when loading them from the cache"""
+        encoded = [command.encode('utf-8') for command in commands]
+        base = len(self.blob)
+        self.blob += b''.join(encoded)
+        self.offsets.extend(itertools.accumulate(map(len, encoded), initial=base))
+        del self.offsets[len(self.offsets) - len(encoded) - 1]  # base was already the last offset
+        self.hashes.extend(map(hash, commands))
+        self.alive += b'\1' * len(commands)
+        self.live += len(commands)
+        self.slots = None
+
+    def table(self) -> array:
+        return self.slots if self.slots is not None else self.rehash()
+
+    def rehash(self) -> array:
+        """Size the table for twice the alive rows and drop the dead ones from it"""
+        size = 8
+        while size < 2 * (self.live + 1):
+            size *= 2
+        slots = self.slots = array('i', [-1]) * size
+        mask = size - 1
+        hashes = self.hashes
+        for row in itertools.compress(range(len(hashes)), self.alive):
+            slot = hashes[row] & mask
+            while slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            slots[slot] = row
+        self.used = self.live
+        return slots
+
+    def kill(self, row: int):
+        self.alive[row] = 0
+        self.live -= 1
+
+    def find(self, command: str) -> Optional[int]:
+        """The alive row holding command, if any"""
+        key = hash(command)
+        slots, hashes, alive = self.table(), self.hashes, self.alive
+        mask = len(slots) - 1
+        slot = key & mask
+        row = slots[slot]
+        while row >= 0:
+            if hashes[row] == key and alive[row] and self.command(row) == command:
+                return row
+            slot = (slot + 1) & mask
+            row = slots[slot]
+        return None
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def command(self, row: int) -> str:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].decode('utf-8')
+
+class FrecencyIndex:
+    """Per-command use count, last use and decayed score, kept ranked incrementally
+
+    A command's score is the sum of 2^(-age / HALF_LIFE) over its uses. The stored
+    key is the log of that score scaled by a constant factor that is the same for
+    every command, so keys order commands correctly at any moment without being
+    re-decayed, and recording a use is one bisect into the ranked ids. An index
+    built from scratch is ranked with a single sort when first read instead.
+    Commands get an id in a CommandTable; counts, last uses and keys are arrays
+    indexed by it.
+    """
+    HALF_LIFE = 7 * 24 * 3600
+
+    def __init__(self, rows: Optional[list] = None):
+        self.names = CommandTable()
+        self.names.extend([row[0] for row in rows or []])
+        self.counts = array('q', [row[1] for row in rows or []])
+        self.last_used = array('q', [row[2] for row in rows or []])
+        self.keys = array('d', [row[3] for row in rows or []])
+        # Ids ordered by (key, command), lowest first; None until rank() on a bulk load
+        self.order: Optional[array] = array('l', range(len(self.keys))) if rows is not None else None
+        self.clock = max(self.last_used, default=0)
+
+    def insert(self, command: str, count: int, last_used: int, key: float) -> int:
+        cid = self.names.append(command)
+        self.counts.append(count)
+        self.last_used.append(last_used)
+        self.keys.append(key)
+        return cid
+
+    def rank(self) -> array:
+        if self.order is None:
+            keys, alive, command = self.keys, self.names.alive, self.names.command
+            order = sorted((cid for cid in range(len(keys)) if alive[cid]), key=keys.__getitem__)
+            start = 0
+            for end in range(1, len(order) + 1):  # Equal keys go by command
+                if end == len(order) or keys[order[end]] != keys[order[start]]:
+                    if end - start > 1:
+                        order[start:end] = sorted(order[start:end], key=command)
+                    start = end
+            self.order = array('l', order)
+        return self.order
+
+    def position(self, cid: int) -> int:
+        """Where cid belongs in self.order"""
+        keys, command = self.keys, self.names.command
+        key, name = keys[cid], command(cid)
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = self.order[mid]
+            if keys[other] < key or keys[other] == key and command(other) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def merge(self, cid: int, count: int, last_used: int, key: float):
+        high, low = max(self.keys[cid], key), min(self.keys[cid], key)
+        self.counts[cid] += count
+        self.last_used[cid] = max(self.last_used[cid], last_used)
+        self.keys[cid] = high + math.log1p(math.exp(low - high))
+
+    def add(self, command: str, timestamp: Optional[int]):
+        """Record one use; uses may arrive in any order"""
+        if timestamp is None:
+            timestamp = self.clock  # Untimestamped history ranks by count alone
+        self.clock = max(self.clock, timestamp)
+        weight = timestamp * math.log(2) / self.HALF_LIFE
+        cid = self.names.find(command)
+        if cid is None:
+            cid = self.insert(command, 1, timestamp, weight)
+        else:
+            if self.order is not None:
+                del self.order[self.position(cid)]
+            self.merge(cid, 1, timestamp, weight)
+        if self.order is not None:
+            self.order.insert(self.position(cid), cid)
+
+    def combine(self, command: str, count: int, last_used: int, key: float):
+        """Fold in uses summarized elsewhere, e.g. by a parse worker; bulk loads only"""
+        cid = self.names.find(command)
+        if cid is None:
+            self.insert(command, count, last_used, key)
+        else:
+            self.merge(cid, count, last_used, key)
+        self.order = None
+        self.clock = max(self.clock, last_used)
+
+    def remove(self, command: str):
+        cid = self.names.find(command)
+        if cid is not None:
+            if self.order is not None:
+                del self.order[self.position(cid)]
+            self.names.kill(cid)
+
+    def top(self, k: int) -> List[str]:
+        """The k highest ranked commands, best first"""
+        return [self.names.command(cid) for cid in reversed(self.rank()[-k:])] if k > 0 else []
+
+    def row(self, cid: int) -> list:
+        return [self.names.command(cid), self.counts[cid], self.last_used[cid], self.keys[cid]]
+
+    def rows(self) -> list:
+        """Serializable records, already in rank order"""
+        return [self.row(cid) for cid in self.rank()]
+
+    def records(self) -> list:
+        """Serializable records in no particular order"""
+        alive = self.names.alive
+        return [self.row(cid) for cid in range(len(self.keys)) if alive[cid]]
+
+class HistoryStore(CommandTable):
+    """Columnar storage for deduplicated history entries
+
+    Commands live in the CommandTable blob and timestamps in an array('q') (0
+    when unknown) indexed by the same row. datetimes are only built for the
+    rows that ask for one.
+
+    Appends go in place: a command used again gets a new row and its old row is
+    marked dead, and rows dropped off the cap are dead too. len() counts every
+    row, dead or alive; live holds the number of alive ones.
+    """
+    def __init__(self):
+        super().__init__()
+        self.epochs = array('q')
+        self.line_numbers = array('l')
+        self.first = 0  # Rows before this one are all dead
+        self.numbered = True  # False until line_numbers are recomputed after a push
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[str, Optional[int]]]) -> 'HistoryStore':
+        """Build from (command, epoch) pairs in chronological order, numbered from 1"""
+        items = list(items)
+        store = cls()
+        store.extend([command for command, _ in items])
+        store.epochs.extend([timestamp or 0 for _, timestamp in items])
+        store.line_numbers.extend(range(1, len(items) + 1))
+        return store
+
+    def append(self, command: str, timestamp: Optional[int], line_number: int) -> int:
+        self.epochs.append(timestamp or 0)
+        self.line_numbers.append(line_number)
+        return super().append(command)
+
+    def push(self, command: str, timestamp: Optional[int]) -> int:
+        """Append a newly used command, retiring its previous row"""
+        row = self.find(command)
+        if row is not None:
+            self.kill(row)
+        self.numbered = False
+        return self.append(command, timestamp, 0)
+
+    def kill(self, row: int):
+        super().kill(row)
+        self.numbered = False
+
+    def drop_oldest(self, count: int) -> List[str]:
+        """Retire the count oldest live rows; returns their commands"""
+        dropped = []
+        while len(dropped) < count and self.first < len(self):
+            if self.alive[self.first]:
+                dropped.append(self.command(self.first))
+                self.kill(self.first)
+            self.first += 1
+        return dropped
+
+    def epoch(self, row: int) -> Optional[int]:
+        return self.epochs[row] or None
+
+    def timestamp(self, row: int):
+        """The row's datetime, or None if the shell did not record one"""
+        from datetime import datetime
+        return datetime.fromtimestamp(self.epochs[row]) if self.epochs[row] else None
+
+    def line_number(self, row: int) -> int:
+        if not self.numbered:
+            for number, live_row in enumerate(self.live_rows(), 1):
+                self.line_numbers[live_row] = number
+            self.numbered = True
+        return self.line_numbers[row]
+
+    def live_rows(self) -> Iterator[int]:
+        """Alive rows, oldest first"""
+        alive = self.alive
+        return (row for row in range(self.first, len(self)) if alive[row])
+
+    def newest_first(self) -> List[int]:
+        alive = self.alive
+        return [row for row in range(len(self) - 1, self.first - 1, -1) if alive[row]]
+
+    def items(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """(command, epoch) pairs of the alive rows, oldest first"""
+        for row in self.live_rows():
+            yield self.command(row), self.epoch(row)
+
+class TrigramIndex:
+    """Trigram inverted index with fzf-style fuzzy scoring over every unique command
+
+    Commands get a stable id the first time they are seen, so newly appended
+    history only adds postings. A query's candidates are the commands holding
+    all of its trigrams; only when none of those match (e.g. "gco" for
+    "git checkout") is every command tried as a fuzzy subsequence match.
+    """
+    SCORE_MATCH = 16
+    BONUS_BOUNDARY = 8
+    BONUS_CONSECUTIVE = 4
+    PENALTY_GAP_START = 3
+    PENALTY_GAP_EXTENSION = 1
+    DELIMITERS = frozenset(' /-_.,:;=|&()"\'')
 
-class HistoryManager:
     def __init__(self):
+        self.commands: List[str] = []
+        self.lowered: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+        self.recency = array('l')  # id -> row in the indexed store, -1 if not in it
+        self.store: Optional[HistoryStore] = None
+        self.indexed = 0  # Rows of self.store already read
+
+    def update(self, store: HistoryStore):
+        """Index commands new in store and take row order from it as recency
+
+        Stores only grow in place, so just the rows past the indexed watermark
+        are read; a different store (rebuilt from scratch) resets recency.
+        """
+        if store is not self.store:
+            self.store = store
+            self.indexed = 0
+            self.recency = array('l', [-1]) * len(self.commands)
+        recency = self.recency
+        alive = store.alive
+        for row in range(self.indexed, len(store)):
+            if not alive[row]:
+                continue  # Used again or dropped since; a newer row has it if it is still there
+            command = store.command(row)
+            cid = self.ids.get(command)
+            if cid is None:
+                cid = self.add(command)
+                recency.append(-1)
+            recency[cid] = row
+        self.indexed = len(store)
+
+    def add(self, command: str) -> int:
+        cid = len(self.commands)
+        lowered = command.lower()
+        self.commands.append(command)
+        self.lowered.append(lowered)
+        self.ids[command] = cid
+        for gram in {lowered[i:i + 3] for i in range(len(lowered) - 2)}:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('l')
+            postings.append(cid)
+        return cid
+
+    def fuzzy_score(self, pattern: str, text: str) -> Optional[int]:
+        """Score pattern as a subsequence of text, fzf v1 style; None if it does not match"""
+        # Leftmost match end, then the shortest window ending there
+        end = -1
+        for ch in pattern:
+            end = text.find(ch, end + 1)
+            if end < 0:
+                return None
+        start = end + 1
+        for ch in reversed(pattern):
+            start = text.rfind(ch, 0, start)
+
+        score = 0
+        pi = 0
+        matched_previous = False
+        for i in range(start, end + 1):
+            if pi < len(pattern) and text[i] == pattern[pi]:
+                bonus = self.BONUS_BOUNDARY if i == 0 or text[i - 1] in self.DELIMITERS else 0
+                if matched_previous:
+                    bonus = max(bonus, self.BONUS_CONSECUTIVE)
+                score += self.SCORE_MATCH + (2 * bonus if pi == 0 else bonus)
+                pi += 1
+                matched_previous = True
+            else:
+                score -= self.PENALTY_GAP_EXTENSION if not matched_previous else self.PENALTY_GAP_START
+                matched_previous = False
+        return score
+
+    def score(self, cids: Iterable[int], terms: List[str]) -> List[Tuple[int, int, int]]:
+        results = []
+        alive = self.store.alive if self.store else b''
+        for cid in cids:
+            row = self.recency[cid]
+            if row < 0 or not alive[row]:
+                continue
+            total = 0
+            for term in terms:
+                term_score = self.fuzzy_score(term, self.lowered[cid])
+                if term_score is None:
+                    break
+                total += term_score
+            else:
+                results.append((total, row, cid))
+        return results
+
+    def search(self, query: str, limit: int) -> List[str]:
+        """Best matches for the space-separated terms of query, most recent first among equals"""
+        terms = query.lower().split()
+        if not terms:
+            return []
+        grams = {term[i:i + 3] for term in terms for i in range(len(term) - 2)}
+        results = []
+        if grams:
+            postings = sorted((self.postings.get(gram, array('l')) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for other in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(other)
+            results = self.score(candidates, terms)
+        if not results:
+            results = self.score(range(len(self.commands)), terms)
+        return [self.commands[cid] for _, _, cid in heapq.nlargest(limit, results)]
+
+class HistoryFilter:
+    """Drops ignored commands (DEFAULT_IGNORE plus IGNORE_FILE) while history is parsed
+
+    All literal rules go into one set of word prefixes and all regex rules into
+    one alternation, so an entry costs a few set lookups and a single search
+    however many rules there are. Leading global flags such as (?i) are scoped
+    to their rule; rules with backreferences, whose group numbers would shift,
+    and any rule that will not combine are searched on their own. Rejected
+    commands are memoized, and saved with the parsed-history cache; accepted
+    ones are not, as that would keep a copy of every command alive.
+    """
+    GLOBAL_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+    BACKREFERENCE = re.compile(r'\\[1-9]|\(\?\(\d')  # \1 or (?(1)yes|no)
+
+    def __init__(self, rules: Iterable[str]):
+        self.rules = list(rules)
+        self.key = f"{zlib.crc32(chr(10).join(self.rules).encode()):08x}"  # Caches parsed under other rules are stale
+        self.prefixes = set()
+        patterns = []
+        self.separate: List[re.Pattern] = []  # Regex rules searched one by one
+        for rule in self.rules:
+            if rule.startswith('re:'):
+                try:
+                    pattern = self.scoped(rule[3:])
+                    compiled = re.compile(pattern)
+                except re.error as e:
+                    print(f"⚠️ Ignoring bad rule in {IGNORE_FILE}: {rule!r} ({e})", file=sys.stderr)
+                    continue
+                if self.BACKREFERENCE.search(rule[3:]):
+                    self.separate.append(compiled)
+                else:
+                    patterns.append(pattern)
+            elif rule.split():
+                self.prefixes.add(' '.join(rule.split()))
+        self.depth = max((prefix.count(' ') + 1 for prefix in self.prefixes), default=0)
+        self.pattern = self.combine(patterns)
+        self.rejections: Set[str] = set()
+
+    @classmethod
+    def scoped(cls, pattern: str) -> str:
+        """The rule as a group of its own, e.g. (?i)secret -> (?i:secret)"""
+        flags = ''
+        match = cls.GLOBAL_FLAGS.match(pattern)
+        while match:
+            flags += match.group(1)
+            pattern = pattern[match.end():]
+            match = cls.GLOBAL_FLAGS.match(pattern)
+        if not flags:
+            return f"(?:{pattern})"
+        return f"(?{flags}:{pattern}{chr(10) if 'x' in flags else ''})"  # Ends a trailing verbose comment
+
+    def combine(self, patterns: List[str]) -> Optional[re.Pattern]:
+        """One alternation of patterns; those that break it (e.g. a repeated group name) go to self.separate"""
+        if not patterns:
+            return None
+        try:
+            return re.compile('|'.join(patterns))
+        except re.error:
+            pass
+        kept = []
+        for pattern in patterns:
+            try:
+                re.compile('|'.join(kept + [pattern]))
+                kept.append(pattern)
+            except re.error:
+                self.separate.append(re.compile(pattern))
+        return re.compile('|'.join(kept)) if kept else None
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def default(cls) -> 'HistoryFilter':
+        """The filter for this process, built from DEFAULT_IGNORE and IGNORE_FILE once"""
+        rules = list(DEFAULT_IGNORE)
+        try:
+            with open(IGNORE_FILE, 'r', encoding='utf-8') as f:
+                rules += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        except OSError:
+            pass
+        return cls(rules)
+
+    def rejects(self, command: str) -> bool:
+        if command in self.rejections:
+            return True
+        if self.matches(command):
+            self.rejections.add(command)
+            return True
+        return False
+
+    def matches(self, command: str) -> bool:
+        if self.prefixes:
+            words = command.split(None, self.depth)
+            for n in range(1, min(len(words), self.depth) + 1):
+                if ' '.join(words[:n]) in self.prefixes:
+                    return True
+        if self.pattern is not None and self.pattern.search(command) is not None:
+            return True
+        return any(pattern.search(command) for pattern in self.separate)
+
+    def rejected(self) -> List[str]:
+        return list(self.rejections)
+
+    def remember(self, rejected: Iterable[str]):
+        """Take rejections saved by an earlier run with the same rules"""
+        self.rejections.update(rejected)
+
+class HistoryParser:
+    """Parses fish, zsh and bash history, forwards or newest-first from the end of the file"""
+    BLOCK_SIZE = 1 << 20
+    FIRST_BLOCK = 1 << 14  # Blocks grow from here so the newest entries come back quickly
+    TAIL_CHECK = 64  # Bytes before the parsed offset remembered to tell an append from a rewrite
+    CHUNK_SIZE = 16 << 20  # Unit of work when reading the whole file, in parallel if there are several
+
+    FISH_ENTRY = re.compile(r'^- cmd: (.*)\n(?:  when: (\d+))?', re.M)
+    FISH_RECORD = re.compile(r'^- cmd: (.*)\n(?:  when: (\d+)\n)?(?:  paths:\n((?:    - .*\n)*))?', re.M)
+    # Extended (`: ts:duration;cmd`) or plain lines; a trailing backslash continues the command
+    ZSH_ENTRY = re.compile(r'^(?:: (\d+):\d+;)?((?:[^\n]*\\\n)*[^\n]*)', re.M)
+    # Plain lines, optionally preceded by a `#epoch` line when HISTTIMEFORMAT is set
+    BASH_ENTRY = re.compile(r'^(?:#(\d+)\n)?(.*)', re.M)
+
+    def __init__(self, history_file: Path):
+        name = history_file.name
+        if 'fish_history' in name:
+            self.shell = 'fish'
+        elif 'bash' in name:
+            self.shell = 'bash'
+        else:
+            self.shell = 'zsh'
+        self.filter = HistoryFilter.default()
+
+    def parse(self, content: str) -> List[Tuple[str, Optional[int]]]:
+        """Parse history text into (command, epoch) pairs, oldest first"""
+        entries = []
+        rejects = self.filter.rejects
+        if self.shell == 'fish':
+            for m in self.FISH_ENTRY.finditer(content):
+                command = m.group(1).strip()
+                if command and not rejects(command):
+                    entries.append((command, int(m.group(2)) if m.group(2) else None))
+        else:
+            pattern = self.ZSH_ENTRY if self.shell == 'zsh' else self.BASH_ENTRY
+            for m in pattern.finditer(content):
+                command = m.group(2).replace('\\\n', '\n').strip()
+                if command and not rejects(command):
+                    entries.append((command, int(m.group(1)) if m.group(1) else None))
+        return entries
+
+    def records(self, content: str) -> List[Tuple[str, Optional[int], List[str]]]:
+        """Like parse, plus the path arguments fish lists under each command (none for other shells)"""
+        if self.shell != 'fish':
+            return [(command, timestamp, []) for command, timestamp in self.parse(content)]
+        records = []
+        for m in self.FISH_RECORD.finditer(content):
+            command = m.group(1).strip()
+            if command and not self.filter.rejects(command):
+                paths = [line[6:] for line in m.group(3).splitlines()] if m.group(3) else []
+                records.append((command, int(m.group(2)) if m.group(2) else None, paths))
+        return records
+
+    def boundary(self, data: bytes, timestamped: bool) -> Optional[int]:
+        """Offset of the first entry start in data that is known to follow a line break"""
+        if self.shell == 'fish':
+            m = re.search(rb'\n(?=- cmd: )', data)
+        elif self.shell == 'zsh':
+            m = re.search(rb'(?<!\\)\n', data)
+        elif timestamped:
+            m = re.search(rb'\n(?=#\d+\n)', data)
+        else:
+            m = re.search(rb'\n', data)
+        return m.end() if m else None
+
+    def timestamped(self, buf, end: int) -> bool:
+        """Whether bash wrote `#epoch` lines (HISTTIMEFORMAT set) near the end of buf[:end]"""
+        return self.shell == 'bash' and re.search(
+            rb'(?m)^#\d+$', buf[max(0, end - self.BLOCK_SIZE):end]) is not None
+
+    def iter_reverse(self, buf, end: int) -> Iterator[Tuple[str, Optional[int]]]:
+        """Yield entries of buf[:end] newest first, decoding one block at a time"""
+        timestamped = self.timestamped(buf, end)
+        start = end
+        block = self.FIRST_BLOCK
+        while end > 0:
+            start = max(0, start - block)
+            block = min(block * 2, self.BLOCK_SIZE)
+            data = buf[start:end]
+            cut = self.boundary(data, timestamped) if start > 0 else 0
+            if cut is None:
+                continue  # No complete entry yet: widen the window
+            entries = self.parse(data[cut:].decode('utf-8', errors='ignore'))
+            end = start = start + cut
+            yield from reversed(entries)
+
+    def read_latest(self, history_file: Path, max_commands: int,
+                    on_entry=None, on_unique=None) -> Tuple[List[Tuple[str, Optional[int]]], int]:
+        """Return the newest max_commands unique commands (oldest first) and the offset parsed up to
+
+        on_entry(command, timestamp) is called for every use read, duplicates included;
+        on_unique(command, timestamp) as each unique command is found, newest first.
+        """
+        latest: Dict[str, Optional[int]] = {}
+        with open(history_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return [], 0
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                # Leave a partially written last line for the append parser
+                end = mm.rfind(b'\n') + 1
+                for command, timestamp in self.iter_reverse(mm, end):
+                    if on_entry:
+                        on_entry(command, timestamp)
+                    if command not in latest:
+                        latest[command] = timestamp
+                        if on_unique:
+                            on_unique(command, timestamp)
+                        if len(latest) == max_commands:
+                            break
+        return list(reversed(latest.items())), end
+
+    def chunk_bounds(self, buf, end: int, start: int = 0) -> List[Tuple[int, int]]:
+        """Entry-aligned [start, end) ranges of about CHUNK_SIZE bytes covering buf[start:end]"""
+        timestamped = self.timestamped(buf, end)
+        bounds = []
+        while end - start > self.CHUNK_SIZE:
+            cut = start + self.CHUNK_SIZE
+            length = self.FIRST_BLOCK
+            boundary = self.boundary(buf[cut:cut + length], timestamped)
+            while boundary is None and cut + length < end:
+                length *= 2
+                boundary = self.boundary(buf[cut:cut + length], timestamped)
+            if boundary is None or cut + boundary >= end:
+                break
+            bounds.append((start, cut + boundary))
+            start = cut + boundary
+        bounds.append((start, end))
+        return bounds
+
+    def read_all(self, history_file: Path) -> Tuple[List[Tuple[str, Optional[int]]], int, FrecencyIndex]:
+        """Every unique command (oldest first), the offset parsed up to and the frecency of all uses
+
+        The file is cut into entry-aligned chunks that a process pool parses when
+        there are several and this process is single-threaded (--query, stats),
+        and this process otherwise: forking with other threads running (the
+        daemon's watchers and handlers) can deadlock the child on a lock one of
+        them held. Chunks are merged in file order for latest-wins dedup and
+        newest first for frecency, so the result is the same whatever the
+        number of workers.
+        """
+        with open(history_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return [], 0, FrecencyIndex()
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                end = mm.rfind(b'\n') + 1
+                bounds = self.chunk_bounds(mm, end)
+
+        jobs = [(str(history_file), start, stop) for start, stop in bounds if stop > start]
+        workers = min(len(jobs), os.cpu_count() or 1) if threading.active_count() == 1 else 1
+        results = None
+        if workers > 1:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            try:
+                # fork: workers inherit this module, however it was loaded
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    results = list(pool.map(parse_chunk, *zip(*jobs)))
+            except Exception:
+                pass  # No pool here (e.g. no fork): same chunks in this process
+        if results is None:
+            results = [parse_chunk(*job) for job in jobs]
+
+        latest: Dict[str, Optional[int]] = {}
+        for chunk_latest, _, _ in results:
+            for command, timestamp in chunk_latest:
+                latest.pop(command, None)
+                latest[command] = timestamp
+
+        # Uses without a timestamp count as happening at the newest known time. Their
+        # counts are summed over all chunks first, so the key is the same however
+        # the file was cut.
+        clock = max((record[2] for _, records, _ in results for record in records), default=0)
+        untimed_weight = clock * math.log(2) / FrecencyIndex.HALF_LIFE
+        frecency = FrecencyIndex()
+        untimed_counts: Dict[str, int] = {}
+        for _, records, untimed in reversed(results):
+            for command, count, last_used, key in records:
+                frecency.combine(command, count, last_used, key)
+            for command, count in untimed:
+                untimed_counts[command] = untimed_counts.get(command, 0) + count
+        for command, count in untimed_counts.items():
+            frecency.combine(command, count, clock, untimed_weight + math.log(count))
+        return list(latest.items()), end, frecency
+
+    def iter_file(self, history_file: Path) -> Iterator[Tuple[str, Optional[int]]]:
+        """Entries of a whole file newest first, one block in memory at a time"""
+        with open(history_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                yield from self.iter_reverse(mm, mm.rfind(b'\n') + 1)
+
+    def read_tail(self, history_file: Path, offset: int) -> str:
+        """Hex of the bytes just before offset"""
+        start = max(0, offset - self.TAIL_CHECK)
+        with open(history_file, 'rb') as f:
+            f.seek(start)
+            return f.read(offset - start).hex()
+
+    def read_appended(self, history_file: Path, offset: int,
+                      on_entry=None) -> Tuple[List[Tuple[str, Optional[int]]], int]:
+        """Parse complete entries written after offset; returns them with the new offset"""
+        with open(history_file, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        entries = self.parse(data[:end].decode('utf-8', errors='ignore'))
+        if on_entry:
+            for command, timestamp in entries:
+                on_entry(command, timestamp)
+        return entries, offset + end
+
+def parse_chunk(history_file: str, start: int, end: int) -> Tuple[list, list, list]:
+    """Parse bytes [start, end) of a history file, summarized for HistoryParser.read_all
+
+    Returns the chunk's unique commands in last-use order with their last epoch,
+    frecency records of its timestamped uses and (command, count) of the uses
+    without a timestamp. Module level so that pool workers can unpickle it.
+    """
+    parser = HistoryParser(Path(history_file))
+    with open(history_file, 'rb') as f, mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as mm:
+        entries = parser.parse(mm[start:end].decode('utf-8', errors='ignore'))
+    latest: Dict[str, Optional[int]] = {}
+    frecency = FrecencyIndex()
+    untimed: Dict[str, int] = {}
+    for command, timestamp in reversed(entries):  # Newest first, like the serial reader
+        if timestamp is None:
+            untimed[command] = untimed.get(command, 0) + 1
+        else:
+            frecency.add(command, timestamp)
+        if command not in latest:
+            latest[command] = timestamp
+    return list(reversed(latest.items())), frecency.records(), list(untimed.items())
+
+class TimeIndex:
+    """Sparse epoch -> byte offset samples of one history file, saved in the cache dir
+
+    Shells append history in time order, so a time window is one byte range of
+    the file. One entry start is probed every STRIDE bytes, which reads a few KiB
+    per probe rather than the whole file; a window query then parses only the
+    range between the samples around it.
+    """
+    VERSION = 1
+    STRIDE = 1 << 16
+    PROBE = 1 << 12  # First read per probe, doubled until an entry with a timestamp turns up
+
+    def __init__(self, history_file: Path, parser: HistoryParser):
+        digest = f"{zlib.crc32(str(history_file).encode()):08x}"
+        self.path = CACHE_DIR / f"{history_file.name}-{digest}.times.json"
+        self.parser = parser
+        self.offsets = array('Q')
+        self.epochs = array('q')  # Running maximum, so bisect copes with slightly out-of-order merges
+        self.state: Optional[dict] = None
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.offsets, self.epochs = array('Q', data.pop('offsets')), array('q', data.pop('epochs'))
+                self.state = data
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def probe(self, buf, position: int, size: int, timestamped: bool) -> Optional[Tuple[int, int]]:
+        """(entry start, epoch) for the first timestamped entry at or after position"""
+        length = self.PROBE
+        while length <= self.STRIDE:
+            data = buf[position:min(size, position + length)]
+            cut = self.parser.boundary(data, timestamped) if position else 0
+            if cut is not None:
+                for _, timestamp in self.parser.parse(data[cut:].decode('utf-8', errors='ignore')):
+                    if timestamp:
+                        return position + cut, timestamp
+            if position + length >= size:
+                break
+            length *= 2
+        return None
+
+    def update(self, buf, size: int, inode: int):
+        """Probe whatever the file gained since the saved samples, starting over if it was rewritten"""
+        if self.state is None:
+            self.load()
+        state = self.state or {}
+        indexed = state.get('size', 0)
+        if (state.get('inode') != inode or indexed > size
+                or buf[max(0, indexed - HistoryParser.TAIL_CHECK):indexed].hex() != state.get('tail')):
+            self.offsets, self.epochs = array('Q'), array('q')
+            probed = -self.STRIDE
+        elif indexed == size:
+            return
+        else:
+            probed = state['probed']
+
+        timestamped = self.parser.timestamped(buf, size)
+        for position in range(probed + self.STRIDE, size, self.STRIDE):
+            probed = position
+            sample = self.probe(buf, position, size, timestamped)
+            if sample and (not self.offsets or sample[0] > self.offsets[-1]):
+                self.offsets.append(sample[0])
+                self.epochs.append(max(sample[1], self.epochs[-1] if self.epochs else 0))
+        self.state = {'version': self.VERSION, 'inode': inode, 'size': size, 'probed': probed,
+                      'tail': buf[max(0, size - HistoryParser.TAIL_CHECK):size].hex()}
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_file.write_text(json.dumps({**self.state, 'offsets': self.offsets.tolist(),
+                                             'epochs': self.epochs.tolist()}), encoding='utf-8')
+            os.replace(temp_file, self.path)
+        except OSError:
+            pass  # Probing again next time is cheap
+
+    def entries(self, buf, size: int, since: Optional[int], until: Optional[int]) -> List[Tuple[str, int]]:
+        """Entries with since <= epoch <= until, oldest first, parsed from the samples around them"""
+        start, end = 0, None  # None: up to the end of the file
+        if since is not None:
+            first = bisect.bisect_left(self.epochs, since)
+            start = self.offsets[first - 1] if first else 0
+        if until is not None:
+            last = bisect.bisect_right(self.epochs, until)
+            if last == 0 and self.offsets:
+                return []  # Before the first timestamped entry
+            end = self.offsets[last] if last < len(self.offsets) else None
+        if end is None:
+            end = buf.rfind(b'\n', 0, size) + 1  # Leave a partially written last entry
+        lowest, highest = since or 0, until if until is not None else float('inf')
+        return [(command, timestamp)
+                for command, timestamp in self.parser.parse(buf[start:end].decode('utf-8', errors='ignore'))
+                if timestamp and lowest <= timestamp <= highest]
+
+class HistoryAggregate:
+    """Counters over every entry of one history file, saved in the cache dir and extended as it grows
+
+    Entries are folded in one pass, a chunk at a time. Later runs parse only
+    what was appended since the saved offset (checked against the inode and the
+    bytes before it, like the history cache) and start over only when the shell
+    rewrote the file. Subclasses name their saved FIELDS and implement reset and add.
+    """
+    VERSION = 1
+    SUFFIX = ''
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, history_file: Path):
+        digest = f"{zlib.crc32(str(history_file).encode()):08x}"
+        self.path = CACHE_DIR / f"{history_file.name}-{digest}.{self.SUFFIX}.json"
+        self.history_file = history_file
+        self.parser = HistoryParser(history_file)
+        self.state: dict = {}
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def add(self, records: Iterable[Tuple[str, Optional[int], List[str]]]):
+        raise NotImplementedError
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                for field in self.FIELDS:
+                    setattr(self, field, data[field])
+                self.state = data['state']
+        except (OSError, ValueError, KeyError, TypeError):
+            self.reset()
+
+    def update(self):
+        """Fold in whatever the file gained since the saved aggregates, or since the last update"""
+        if not self.state:
+            self.load()
+        with open(self.history_file, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size, inode, mtime = st.st_size, st.st_ino, st.st_mtime_ns
+            if self.state.get('filter') != self.parser.filter.key:
+                self.reset()  # Counted under other ignore rules
+                self.state = {}
+            elif (self.state.get('inode'), self.state.get('size'), self.state.get('mtime')) == (inode, size, mtime):
+                return  # A same-size rewrite still changes the mtime
+            offset = self.state.get('offset', 0)
+            if not size:
+                self.reset()
+                offset, tail = 0, ''
+            else:
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                    if (self.state.get('inode') != inode or offset > size
+                            or mm[max(0, offset - HistoryParser.TAIL_CHECK):offset].hex() != self.state.get('tail')):
+                        self.reset()
+                        offset = 0
+                    end = mm.rfind(b'\n') + 1
+                    for start, stop in self.parser.chunk_bounds(mm, end, offset):
+                        self.add(self.parser.records(mm[start:stop].decode('utf-8', errors='ignore')))
+                    offset = max(offset, end)
+                    tail = mm[max(0, offset - HistoryParser.TAIL_CHECK):offset].hex()
+        self.state = {'inode': inode, 'size': size, 'mtime': mtime, 'offset': offset, 'tail': tail,
+                      'filter': self.parser.filter.key}
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_file.write_text(json.dumps({'version': self.VERSION, 'state': self.state,
+                                             **{field: getattr(self, field) for field in self.FIELDS}}),
+                                 encoding='utf-8')
+            os.replace(temp_file, self.path)
+        except OSError:
+            pass  # Counted again from scratch next time
+
+class HistoryStats(HistoryAggregate):
+    """Usage aggregates for the stats subcommand"""
+    SUFFIX = 'stats'
+    FIELDS = ('total', 'commands', 'executables', 'paths', 'days', 'hours', 'weekdays')
+    ASSIGNMENT = re.compile(r'\w+=')  # Leading VAR=value words are not the executable
+    WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+    def reset(self):
+        self.total = 0
+        self.commands: Dict[str, int] = {}
+        self.executables: Dict[str, int] = {}
+        self.paths: Dict[str, int] = {}
+        self.days: Dict[str, int] = {}
+        self.hours = [0] * 24
+        self.weekdays = [0] * 7
+
+    def add(self, records: Iterable[Tuple[str, Optional[int], List[str]]]):
+        commands, executables, paths, days = self.commands, self.executables, self.paths, self.days
+        for command, timestamp, arguments in records:
+            self.total += 1
+            commands[command] = commands.get(command, 0) + 1
+            words = command.split()
+            executable = next((word for word in words if not self.ASSIGNMENT.match(word)), words[0])
+            executables[executable] = executables.get(executable, 0) + 1
+            for path in arguments:
+                paths[path] = paths.get(path, 0) + 1
+            if timestamp:
+                local = time.localtime(timestamp)
+                self.hours[local.tm_hour] += 1
+                self.weekdays[local.tm_wday] += 1
+                day = time.strftime('%Y-%m-%d', local)
+                days[day] = days.get(day, 0) + 1
+
+    @staticmethod
+    def report(stats: List['HistoryStats'], top: int = 10) -> str:
+        """Plain-text report of the summed aggregates of several files"""
+        def merged(attribute: str) -> Dict[str, int]:
+            counts: Dict[str, int] = {}
+            for item in stats:
+                for key, count in getattr(item, attribute).items():
+                    counts[key] = counts.get(key, 0) + count
+            return counts
+
+        def ranking(title: str, counts: Dict[str, int]) -> List[str]:
+            if not counts:
+                return []
+            lines = ['', title]
+            for key, count in heapq.nlargest(top, counts.items(), key=lambda item: item[1]):
+                lines.append(f"{count:>8}  {key}")
+            return lines
+
+        def histogram(title: str, labels: List[str], counts: List[int]) -> List[str]:
+            peak = max(counts)
+            if not peak:
+                return []
+            return ['', title] + [f"  {label:<3} {'█' * round(30 * count / peak):<30} {count}"
+                                  for label, count in zip(labels, counts)]
+
+        days = merged('days')
+        lines = [f"📊 {sum(item.total for item in stats)} commands, {len(merged('commands'))} unique, "
+                 f"over {len(days)} days in " + ', '.join(str(item.history_file) for item in stats)]
+        lines += ranking("Top commands", merged('commands'))
+        lines += ranking("Top executables", merged('executables'))
+        lines += ranking("Top paths (fish)", merged('paths'))
+        lines += histogram("By hour", [f"{hour:02}" for hour in range(24)],
+                           [sum(item.hours[hour] for item in stats) for hour in range(24)])
+        lines += histogram("By weekday", HistoryStats.WEEKDAYS,
+                           [sum(item.weekdays[day] for item in stats) for day in range(7)])
+        lines += ranking("Busiest days", days)
+        return '\n'.join(lines)
+
+class PathIndex(HistoryAggregate):
+    """Directory -> {command: uses}, from the path arguments fish records for each command
+
+    A path counts for itself and each parent up to (not including) the home or
+    root directory, so the commands for a directory are one lookup however deep
+    the paths under it go. Relative paths are skipped: fish does not record what
+    they were relative to.
+    """
+    SUFFIX = 'paths'
+    FIELDS = ('directories',)
+
+    def reset(self):
+        self.directories: Dict[str, Dict[str, int]] = {}
+
+    def add(self, records: Iterable[Tuple[str, Optional[int], List[str]]]):
+        stops = {os.path.expanduser('~'), '/'}
+        for command, _, arguments in records:
+            counted = set()
+            for path in arguments:
+                path = os.path.normpath(os.path.expanduser(path))
+                if not os.path.isabs(path):
+                    continue
+                while path not in stops and path not in counted:
+                    counted.add(path)
+                    commands = self.directories.setdefault(path, {})
+                    commands[command] = commands.get(command, 0) + 1
+                    path = os.path.dirname(path)
+
+class LineCache:
+    """Rendered rofi text per command (timestamp and escaped, shortened command), saved in the cache dir
+
+    One file per display options, width, time format and zone; a line is rendered
+    again only when its command was used since (a new epoch), so a launch renders
+    just the new entries. Line numbers shift with every new entry and are added
+    when rows are written. Only the lines used in a session are saved back.
+    """
+    VERSION = 1
+
+    def __init__(self, show_timestamps: bool, width: int):
+        key = f"{self.VERSION}|{show_timestamps}|{width}|{HistoryManager.TIME_FORMAT}|{time.tzname}"
+        self.path = CACHE_DIR / f"lines-{zlib.crc32(key.encode()):08x}.json"
+        self.lines: Optional[Dict[str, list]] = None
+        self.used: Dict[str, list] = {}
+        self.rendered = 0
+
+    def get(self, command: str, epoch: Optional[int]) -> Optional[str]:
+        if self.lines is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.lines = json.load(f)
+            except (OSError, ValueError):
+                self.lines = {}
+        line = self.lines.get(command)
+        if line is None or line[0] != epoch:
+            return None
+        self.used[command] = line
+        return line[1]
+
+    def put(self, command: str, epoch: Optional[int], text: str):
+        self.lines[command] = self.used[command] = [epoch, text]
+        self.rendered += 1
+
+    def save(self):
+        if not self.rendered and (self.lines is None or len(self.used) == len(self.lines)):
+            return  # Nothing new and nothing to drop
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_file.write_text(json.dumps(self.used, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+            os.replace(temp_file, self.path)
+        except OSError:
+            pass  # Rendered again next time
+
+class HistoryManager:
+    STATE_KEYS = ('inode', 'size', 'mtime', 'offset', 'tail', 'max_commands', 'filter')
+    SAVE_INTERVAL = 0  # Minimum seconds between cache writes for in-place appends
+    TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+    def __init__(self, merge_shells: bool = False, extra_files: Iterable[Path] = ()):
         self.history_file = self.get_history_file()
-        self.commands = []
+        self.history_files = self.get_history_files(extra_files) if merge_shells else [self.history_file]
+        if len(self.history_files) == 1:
+            self.history_file = self.history_files[0]  # The one file --all-shells found, whatever $SHELL is
+        self.merged_key = None  # max_commands and (path, inode, size, mtime) of every file behind a merged load
+        self.parser = HistoryParser(self.history_file)
+        self.state = None  # Last loaded cache state, kept warm across load_history calls
+        self.generation = 0  # Bumped whenever self.store changes
+        self.saved = float('-inf')  # time.monotonic() of the last cache write
+        self.frecency = FrecencyIndex()
+        self.store = HistoryStore()  # Loaded commands, oldest first
+        self.index = TrigramIndex()
+        self.index_generation = 0
+        self.time_indexes: Dict[Path, TimeIndex] = {}
+        self.path_indexes: Dict[Path, PathIndex] = {}
+        self.tracer = PhaseTracer()  # Disabled unless the menu passes one in
 
     def get_history_file(self):
         """Get the appropriate history file based on shell"""
@@ -34,81 +1355,95 @@ class HistoryManager:
             return home / '.bash_history'
         else:
             # Try common locations
-            for hist_file in ['.local/share/fish/fish_history', '.zsh_history', '.bash_history', '.history']:
+            for hist_file in HISTORY_FILES:
                 path = home / hist_file
                 if path.exists():
                     return path
         
         return home / '.bash_history'
 
-    def load_history(self, max_commands=1000) -> bool:
-        """Load the most recent command history from file"""
+    def get_history_files(self, extra_files: Iterable[Path] = ()) -> List[Path]:
+        """Every shell history file present, plus configured extras ($TERM_HISTORY_FILES, colon-separated)"""
+        home = Path.home()
+        extra = [Path(path).expanduser() for path in os.environ.get('TERM_HISTORY_FILES', '').split(':') if path]
+        files = []
+        for path in [home / hist_file for hist_file in HISTORY_FILES] + extra + list(extra_files):
+            if path.exists() and path not in files:
+                files.append(path)
+        return files or [self.history_file]
+
+    @traced('parse')
+    def load_history(self, max_commands=1000, on_unique=None) -> bool:
+        """Load the most recent command history, resuming from the cached parse when possible
+
+        max_commands=0 loads the whole history.
+
+        When the file has to be parsed from scratch, on_unique(command, timestamp) is
+        called for each unique command as soon as it is found, newest first (except
+        for whole-history loads, which are parsed in parallel chunks).
+        """
+        if len(self.history_files) > 1:
+            return self.load_merged(max_commands, on_unique)
+
         if not self.history_file.exists():
             self.show_error(f"History file not found: {self.history_file}")
             return False
 
         try:
-            self.commands = []
-            seen_commands = set()
-
-            if 'fish_history' in str(self.history_file):
-                # Read the last ~3000 lines (approx. 1000 fish history entries)
-                with open(self.history_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = tailer.tail(f, 3 * max_commands)  # Estimate: ~3 lines per entry
-                    content = '\n'.join(lines)
-                    entries = content.split('- cmd: ')[1:]  # Skip empty first entry
-
-                    for entry in entries:
-                        lines = entry.strip().split('\n')
-                        if not lines:
-                            continue
-                        command = lines[0].strip()
-                        timestamp = None
-                        for line in lines[1:]:
-                            if line.strip().startswith('when: '):
-                                try:
-                                    ts = int(line.strip().split('when: ')[1])
-                                    timestamp = datetime.fromtimestamp(ts)
-                                except (ValueError, IndexError):
-                                    pass
-                                break
-                        if command and command not in seen_commands:
-                            seen_commands.add(command)
-                            self.commands.append({
-                                'command': command,
-                                'timestamp': timestamp
-                            })
+            st = os.stat(self.history_file)
+            cache = HistoryCache(self.history_file, max_commands)
+            if not (self.state and self.state['max_commands'] == max_commands):
+                self.state = None
+            cached = self.state or cache.load()
+            # Deduplicated command -> epoch, oldest first; a repeated command moves to the end
+            latest: Dict[str, Optional[int]] = {}
+            frecency = FrecencyIndex()
+
+            unchanged = False
+            if (cached and cached['inode'] == st.st_ino and cached['max_commands'] == max_commands
+                    and cached.get('filter') == self.parser.filter.key
+                    and (cached['size'], cached['mtime']) <= (st.st_size, st.st_mtime_ns)):
+                offset = cached['offset']
+                unchanged = cached['size'] == st.st_size and cached['mtime'] == st.st_mtime_ns
+                if cached is self.state:
+                    if unchanged:
+                        return True  # Already built from this state
+                    if st.st_size > cached['size'] and self.parser.read_tail(self.history_file, offset) == cached['tail']:
+                        return self.apply_appended(st, cache, offset, max_commands)
+                else:
+                    latest.update(cached['commands'])
+                    frecency = FrecencyIndex(cached['frecency'])
+                    self.parser.filter.remember(cached.get('rejected', ()))
+                if unchanged:
+                    new_entries = []
+                elif st.st_size > cached['size'] and self.parser.read_tail(self.history_file, offset) == cached['tail']:
+                    # The file only grew: parse just the appended bytes
+                    new_entries, offset = self.parser.read_appended(self.history_file, offset, frecency.add)
+                else:
+                    # Rewritten in place (e.g. fish/zsh merging sessions): start over
+                    latest.clear()
+                    new_entries, offset, frecency = self.read_fresh(max_commands, on_unique)
+            else:
+                new_entries, offset, frecency = self.read_fresh(max_commands, on_unique)
+
+            for command, timestamp in new_entries:
+                latest.pop(command, None)
+                latest[command] = timestamp
+
+            # Drop the least recently used beyond the cap from both orders
+            for command in list(latest)[:-max_commands]:
+                del latest[command]
+                frecency.remove(command)
+
+            self.store = HistoryStore.from_items(latest.items())
+            self.frecency = frecency
+            # Only the file's key stays in memory; entries live in the store
+            if unchanged:
+                self.state = {key: cached[key] for key in self.STATE_KEYS}
             else:
-                # Handle bash/zsh history
-                with open(self.history_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    lines = tailer.tail(f, max_commands)
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        timestamp = None
-                        command = line
-                        if line.startswith(': ') and ';' in line:
-                            try:
-                                parts = line[2:].split(';', 1)
-                                if len(parts) == 2:
-                                    ts_part = parts[0].split(':')[0]
-                                    timestamp = datetime.fromtimestamp(int(ts_part))
-                                    command = parts[1]
-                            except (ValueError, IndexError):
-                                pass
-                        if command and command not in seen_commands:
-                            seen_commands.add(command)
-                            self.commands.append({
-                                'command': command,
-                                'timestamp': timestamp
-                            })
-
-            # Assign line numbers in reverse order
-            total_commands = len(self.commands)
-            for i, cmd in enumerate(self.commands):
-                cmd['line_number'] = i + 1
-            self.commands.reverse()  # Most recent first
+                self.state = self.file_state(st, offset, max_commands)
+                self.save_cache(cache)
+            self.generation += 1
 
             return True
 
@@ -116,43 +1451,899 @@ class HistoryManager:
             self.show_error(f"Error reading history: {e}")
             return False
 
-    def format_command_for_rofi(self, cmd: dict, show_timestamps: bool = True, show_line_numbers: bool = True, max_length: int = 80) -> str:
-        """Format command for Rofi display"""
-        command = cmd['command']
-        parts = []
-        
-        # Add line number if available and requested
-        if show_line_numbers and 'line_number' in cmd:
-            parts.append(f"#{cmd['line_number']:04d}")
-        
-        # Truncate long commands
+    def apply_appended(self, st: os.stat_result, cache: HistoryCache, offset: int, max_commands: int) -> bool:
+        """Apply entries appended to the file to the loaded store and frecency index in place
+
+        A command used again gets a new row and its old row is marked dead, so
+        an append costs only its new entries. The store is compacted once dead
+        rows outnumber live ones, and the cache is written at most every
+        SAVE_INTERVAL seconds; what it holds stays consistent with its offset.
+        """
+        new_entries, offset = self.parser.read_appended(self.history_file, offset, self.frecency.add)
+        store = self.store
+        for command, timestamp in new_entries:
+            store.push(command, timestamp)
+        if max_commands:
+            for command in store.drop_oldest(store.live - max_commands):
+                self.frecency.remove(command)
+        if len(store) > 2 * store.live + 1024:
+            self.store = HistoryStore.from_items(store.items())
+        self.state = self.file_state(st, offset, max_commands)
+        if time.monotonic() - self.saved >= self.SAVE_INTERVAL:
+            self.save_cache(cache)
+        self.generation += 1
+        return True
+
+    def file_state(self, st: os.stat_result, offset: int, max_commands: int) -> dict:
+        return {
+            'inode': st.st_ino,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'offset': offset,
+            'tail': self.parser.read_tail(self.history_file, offset),
+            'max_commands': max_commands,
+            'filter': self.parser.filter.key,
+        }
+
+    def save_cache(self, cache: HistoryCache):
+        cache.save({**self.state, 'commands': list(self.store.items()), 'frecency': self.frecency.rows(),
+                    'rejected': self.parser.filter.rejected()})
+        self.saved = time.monotonic()
+
+    def read_fresh(self, max_commands: int, on_unique=None) -> Tuple[list, int, FrecencyIndex]:
+        """Parse the history file from scratch; whole-file reads go through the chunked parallel parser"""
+        if not max_commands:
+            return self.parser.read_all(self.history_file)
+        frecency = FrecencyIndex()
+        entries, offset = self.parser.read_latest(self.history_file, max_commands, frecency.add, on_unique)
+        return entries, offset, frecency
+
+    def load_merged(self, max_commands=1000, on_unique=None) -> bool:
+        """Load the newest max_commands unique commands across all history files
+
+        Each file is read newest first and the streams are merged on timestamp
+        through a heap, so only one block per file is held at a time and reading
+        stops as soon as enough commands are found. Entries without a timestamp
+        (plain bash history) sort after all timestamped ones.
+        """
+        try:
+            key = [max_commands]
+            for path in self.history_files:
+                st = os.stat(path)
+                key.append((str(path), st.st_ino, st.st_size, st.st_mtime_ns))
+            if key == self.merged_key:
+                return True
+
+            latest: Dict[str, Optional[int]] = {}
+            frecency = FrecencyIndex()
+            streams = [HistoryParser(path).iter_file(path) for path in self.history_files]
+            try:
+                for command, timestamp in heapq.merge(*streams, key=lambda entry: entry[1] or 0, reverse=True):
+                    frecency.add(command, timestamp)
+                    if command not in latest:
+                        latest[command] = timestamp
+                        if on_unique:
+                            on_unique(command, timestamp)
+                        if len(latest) == max_commands:
+                            break
+            finally:
+                for stream in streams:
+                    stream.close()
+
+            self.merged_key = key
+            self.frecency = frecency
+            self.store = HistoryStore.from_items(reversed(latest.items()))
+            self.generation += 1
+            return True
+
+        except Exception as e:
+            self.show_error(f"Error reading history: {e}")
+            return False
+
+    def iter_unique(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """Unique commands across all history files newest first, read lazily
+
+        Nothing is cached: files are parsed only as far back as the caller
+        iterates, so stopping early keeps deep history untouched.
+        """
+        seen = set()
+        streams = [HistoryParser(path).iter_file(path) for path in self.history_files if path.exists()]
+        try:
+            for command, timestamp in heapq.merge(*streams, key=lambda entry: entry[1] or 0, reverse=True):
+                if command not in seen:
+                    seen.add(command)
+                    yield command, timestamp
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def update_path_indexes(self):
+        """Create or extend the PathIndex of each fish history file"""
+        for path in self.history_files:
+            if HistoryParser(path).shell == 'fish' and path.exists():
+                index = self.path_indexes.get(path)
+                if index is None:
+                    index = self.path_indexes[path] = PathIndex(path)
+                index.update()
+
+    def directory_commands(self, directory: str, k: int, refresh: bool = True) -> List[str]:
+        """The k commands most used on paths in or under directory; fish only, none for other shells
+
+        refresh=False answers from the indexes as last updated, e.g. by the daemon's watcher.
+        """
+        if refresh or not self.path_indexes:
+            self.update_path_indexes()
+        counts: Dict[str, int] = {}
+        directory = os.path.normpath(directory)
+        for index in self.path_indexes.values():
+            for command, count in index.directories.get(directory, {}).items():
+                counts[command] = counts.get(command, 0) + count
+        return heapq.nlargest(k, counts, key=counts.__getitem__)
+
+    def ordered(self, sort: str = 'frecency', store: Optional[HistoryStore] = None,
+                frecency: Optional[FrecencyIndex] = None) -> List[int]:
+        """Rows of self.store (or store), most recent first or highest frecency first"""
+        store = store or self.store
+        if sort == 'recent':
+            return store.newest_first()
+        rows = (store.find(command) for command in (frecency or self.frecency).top(store.live))
+        return [row for row in rows if row is not None]
+
+    @traced('parse')
+    def load_window(self, since: Optional[int], until: Optional[int],
+                    max_commands: int = 1000) -> Tuple[HistoryStore, FrecencyIndex]:
+        """The newest max_commands unique commands used between since and until (epochs, inclusive)
+
+        Reads only the part of each history file that the time index places in
+        the window; entries without a timestamp are left out.
+        """
+        entries = []
+        for history_file in self.history_files:
+            index = self.time_indexes.get(history_file)
+            if index is None:
+                index = self.time_indexes[history_file] = TimeIndex(history_file, HistoryParser(history_file))
+            try:
+                with open(history_file, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    if not stat.st_size:
+                        continue
+                    with mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ) as mm:
+                        index.update(mm, stat.st_size, stat.st_ino)
+                        entries.extend(index.entries(mm, stat.st_size, since, until))
+            except OSError:
+                continue
+        entries.sort(key=lambda entry: entry[1])  # Stable, so each file keeps its own order
+
+        frecency = FrecencyIndex()
+        latest: Dict[str, int] = {}
+        for command, timestamp in entries:
+            frecency.add(command, timestamp)
+            latest.pop(command, None)
+            latest[command] = timestamp
+        items = list(latest.items())
+        if max_commands and len(items) > max_commands:
+            for command, _ in items[:-max_commands]:
+                frecency.remove(command)
+            items = items[-max_commands:]
+        return HistoryStore.from_items(items), frecency
+
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        """Fuzzy-search the loaded history (load_history(0) for all of it)"""
+        self.update_index()
+        return self.index.search(query, limit)
+
+    def update_index(self):
+        if self.index_generation != self.generation:
+            self.index.update(self.store)
+            self.index_generation = self.generation
+
+    def shorten(self, command: str, max_length: int = 80) -> str:
+        """Single-line, truncated command for display"""
+        # Multi-line commands would otherwise span several rofi rows
+        command = command.replace('\n', ' ↵ ')
         if len(command) > max_length:
             command = command[:max_length-3] + "…"
-        
-        # Join all parts with separator
-        if parts:
-            return f"{' │ '.join(parts)} │ {command}"
-        
         return command
 
+    def format_command_for_rofi(self, store: HistoryStore, row: int, show_timestamps: bool = True, show_line_numbers: bool = True, max_length: int = 80,
+                                lines: Optional[LineCache] = None) -> str:
+        """Format command for Rofi display, as Pango markup; lines caches all but the line number"""
+        command, epoch = store.command(row), store.epoch(row)
+        text = lines.get(command, epoch) if lines else None
+        if text is None:
+            text = pango_escape(self.shorten(command, max_length))
+            # Timestamps are stored as epochs and only formatted for the rows rendered
+            if show_timestamps:
+                text = f"{time.strftime(self.TIME_FORMAT, time.localtime(epoch)) if epoch else ' ' * 16} │ {text}"
+            if lines:
+                lines.put(command, epoch, text)
+
+        if show_line_numbers:
+            return f"#{store.line_number(row):04d} │ {text}"
+        return text
+
+    @traced('notify')
     def show_error(self, message: str):
         """Show error using rofi"""
         subprocess.run(['rofi', '-e', message], timeout=10)
 
+    @traced('notify')
     def show_notification(self, message: str):
-        """Show notification"""
+        """Show notification without waiting for the notification daemon"""
+        spawn(['notify-send', 'History Menu', message])  # Notifications are optional
+
+class DaemonHistoryManager(HistoryManager):
+    """HistoryManager that logs errors instead of popping up rofi and throttles cache writes"""
+    SAVE_INTERVAL = 300  # The daemon holds the live state; the cache only has to survive restarts
+
+    def show_error(self, message: str):
+        print(f"term-history: {message}", file=sys.stderr)
+
+class HistoryWatcher(threading.Thread):
+    """Calls back whenever the shell touches the history file
+
+    Watches the file's directory with inotify, so atomic renames (fish and zsh
+    rewrite the file on merge) are seen as well as appends. Falls back to
+    polling stat() where inotify is unavailable.
+    """
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+    SETTLE_TIME = 0.05  # Coalesce a burst of writes into one refresh
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, history_file: Path, callback):
+        super().__init__(name='history-watcher', daemon=True)
+        self.history_file = history_file
+        self.callback = callback
+
+    def open_inotify(self) -> Optional[int]:
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO
+                    | self.IN_CREATE | self.IN_DELETE)
+            if libc.inotify_add_watch(fd, str(self.history_file.parent).encode(), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def touches_history(self, data: bytes) -> bool:
+        name = self.history_file.name.encode()
+        pos = 0
+        while pos + self.EVENT_HEADER.size <= len(data):
+            _, _, _, length = self.EVENT_HEADER.unpack_from(data, pos)
+            pos += self.EVENT_HEADER.size
+            if data[pos:pos + length].rstrip(b'\0') == name:
+                return True
+            pos += length
+        return False
+
+    def run(self):
+        fd = self.open_inotify()
+        if fd is None:
+            self.poll()
+            return
+        while True:
+            if not self.touches_history(os.read(fd, 65536)):
+                continue
+            while select.select([fd], [], [], self.SETTLE_TIME)[0]:
+                os.read(fd, 65536)
+            self.callback()
+
+    def poll(self):
+        last = None
+        while True:
+            try:
+                st = os.stat(self.history_file)
+                key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                key = None
+            if key != last:
+                last = key
+                self.callback()
+            time.sleep(self.POLL_INTERVAL)
+
+class FocusWatcher(threading.Thread):
+    """Keeps the PID of the focused window current, so the daemon's menu requests need not ask X
+
+    Follows i3's window focus events, resolving each newly focused window's PID
+    here rather than when the menu opens. Without i3 it polls xdotool instead.
+    """
+    POLL_INTERVAL = 1.0
+
+    def __init__(self):
+        super().__init__(name='focus-watcher', daemon=True)
+        self.pid: Optional[int] = None
+
+    def cwd(self) -> Optional[str]:
+        """Working directory of the shell in the focused window; only reads /proc"""
+        pid = self.pid
+        return shell_cwd(pid) if pid else None
+
+    def follow_i3(self) -> bool:
+        """Track focus events until i3-msg exits; False if it never reported one (no i3)"""
+        try:
+            process = subprocess.Popen(['i3-msg', '-t', 'subscribe', '-m', '["window"]'], stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, text=True)
+        except OSError:
+            return False
+        followed = False
+        with process:
+            for line in process.stdout:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                followed = True
+                window = (event.get('container') or {}).get('window') if isinstance(event, dict) else None
+                if window and event.get('change') == 'focus':
+                    self.pid = window_pid(str(window))
+        return followed
+
+    def run(self):
+        subscribed = True
+        while True:
+            self.pid = window_pid()
+            if subscribed:
+                subscribed = self.follow_i3()  # Returns when i3 restarts, and at once without i3
+            time.sleep(self.POLL_INTERVAL)
+
+class HistoryDaemon:
+    """Keeps parsed history warm in memory and serves pre-rendered rofi lines over a Unix socket
+
+    Protocol, one request per connection:
+      lines <sort> <timestamps 0|1> <line-numbers 0|1>  ->  "ok <generation> <count>" + rendered lines
+      command <generation> <sort> <index>               ->  the command text, empty if unknown
+      search <limit> <query>                            ->  best matches over the whole history,
+                                                            one JSON string per line
+      context <k> <directory>                           ->  the k commands most used under directory,
+                                                            one JSON string per line
+      menu <sort> <timestamps 0|1> <line-numbers 0|1>   ->  "ok <generation> <count> <rofi size> <clipboard size>
+                                                            <context size>", the rofi and clipboard argv and
+                                                            the commands for the focused terminal's directory
+                                                            (NUL-separated, that many bytes each), then their
+                                                            rows and the lines; what term-history-launch.py
+                                                            needs to be the menu
+    """
+    KEEP_GENERATIONS = 4  # Snapshots kept so a client's indices survive a concurrent refresh
+
+    def __init__(self, socket_path: Path = SOCKET_PATH, merge_shells: bool = False,
+                 extra_files: Iterable[Path] = ()):
+        self.socket_path = socket_path
+        self.manager = DaemonHistoryManager(merge_shells, extra_files)
+        self.lock = threading.Lock()
+        # Whole-history manager for search, created by the first query and kept live afterwards
+        self.searcher = None
+        self.search_lock = threading.Lock()
+        self.merge_shells = merge_shells
+        self.extra_files = list(extra_files)
+        # generation -> (store, sort order -> rows)
+        self.snapshots: Dict[int, Tuple[HistoryStore, Dict[str, List[int]]]] = {}
+        self.rendered: Dict[Tuple[int, str, bool, bool], bytes] = {}
+        self.menu: Optional[RofiHistoryMenu] = None  # Builds the rofi command line for launcher clients
+        self.context_lock = threading.Lock()  # Guards the manager's path indexes
+        self.last_context: Tuple[Optional[str], int, List[str]] = (None, 0, [])  # For menus opened mid-update
+        self.focus = FocusWatcher()
+
+    def refresh(self) -> Optional[int]:
+        """Pick up history changes; returns the current generation, or None on error"""
+        with self.lock:
+            if not self.manager.load_history():
+                return None
+            generation = self.manager.generation
+            if generation not in self.snapshots:
+                self.snapshots[generation] = (
+                    self.manager.store, {sort: self.manager.ordered(sort) for sort in SORT_ORDERS})
+                for old in sorted(self.snapshots)[:-self.KEEP_GENERATIONS]:
+                    del self.snapshots[old]
+                self.rendered = {key: data for key, data in self.rendered.items() if key[0] in self.snapshots}
+            return generation
+
+    def render(self, generation: int, sort: str, show_timestamps: bool, show_line_numbers: bool) -> bytes:
+        key = (generation, sort, show_timestamps, show_line_numbers)
+        with self.lock:
+            data = self.rendered.get(key)
+            if data is None:
+                store, orders = self.snapshots[generation]
+                data = '\n'.join(
+                    self.manager.format_command_for_rofi(store, row, show_timestamps, show_line_numbers)
+                    for row in orders[sort]).encode('utf-8')
+                self.rendered[key] = data
+            return data
+
+    def menu_parts(self, sort: str, context: List[str]) -> Tuple[List[str], List[str], bytes]:
+        """The rofi and clipboard commands the full menu would run for a fresh session, and its context rows"""
+        with self.lock:
+            if self.menu is None:
+                self.menu = RofiHistoryMenu(use_daemon=False)
+            self.menu.sort = sort
+            self.menu.context = context
+            return (self.menu.rofi_command(self.menu.get_theme_args(), False, '', 0),
+                    self.menu.backends.clipboard or [], b''.join(self.menu.with_context(())))
+
+    def update_context(self):
+        with self.context_lock:
+            self.manager.update_path_indexes()
+
+    def context_commands(self, directory: Optional[str], k: int, wait: bool = True) -> List[str]:
+        """Commands most used under directory, from the path indexes kept current by the watcher
+
+        While the indexes are being updated, waits up to CONTEXT_WAIT for them,
+        or with wait=False answers at once from the last lookup of directory.
+        """
+        if not directory:
+            return []
+        if not self.context_lock.acquire(timeout=RofiHistoryMenu.CONTEXT_WAIT if wait else 0):
+            # Still being built (first start without a cache) or refreshed: the menu does not wait for it
+            last_directory, last_k, commands = self.last_context
+            return commands[:k] if last_directory == directory and last_k >= k else []
+        try:
+            commands = self.manager.directory_commands(directory, k, refresh=False)
+            self.last_context = (directory, k, commands)
+            return commands
+        finally:
+            self.context_lock.release()
+
+    def history_changed(self):
+        """Watcher callback: refresh the menu rows and path indexes, then the search index once searches started"""
+        self.refresh()
+        self.update_context()
+        if self.searcher:  # Menu opens never wait on this; searches refresh lazily as well
+            self.refresh_search()
+
+    def refresh_search(self) -> bool:
+        with self.search_lock:
+            if self.searcher is None:
+                self.searcher = DaemonHistoryManager(self.merge_shells, self.extra_files)
+            if not self.searcher.load_history(0):
+                return False
+            self.searcher.update_index()
+            return True
+
+    def handle(self, rfile, wfile):
+        line = rfile.readline().decode('utf-8', errors='ignore').rstrip('\n')
+        request = line.split()
+        try:
+            if request[0] in ('lines', 'menu'):
+                generation = self.refresh()
+                if generation is None:
+                    wfile.write(b"error Could not read history\n")
+                    return
+                sort = request[1] if request[1] in SORT_ORDERS else SORT_ORDERS[0]
+                data = self.render(generation, sort, request[2] == '1', request[3] == '1')
+                header = f"ok {generation} {len(self.snapshots[generation][1][sort])}"
+                if request[0] == 'menu':
+                    context = self.context_commands(self.focus.cwd(), RofiHistoryMenu.CONTEXT_COMMANDS, wait=False)
+                    rofi, clipboard, rows = self.menu_parts(sort, context)
+                    rofi, clipboard, context = ('\0'.join(items).encode('utf-8') for items in (rofi, clipboard, context))
+                    wfile.write(f"{header} {len(rofi)} {len(clipboard)} {len(context)}\n".encode()
+                                + rofi + clipboard + context + rows)
+                else:
+                    wfile.write(f"{header}\n".encode())
+                wfile.write(data)
+            elif request[0] == 'command':
+                with self.lock:
+                    store, orders = self.snapshots.get(int(request[1]), (None, {}))
+                rows = orders.get(request[2], [])
+                index = int(request[3])
+                if 0 <= index < len(rows):
+                    wfile.write(store.command(rows[index]).encode('utf-8'))
+            elif request[0] == 'search':
+                limit = int(request[1])
+                query = line.split(' ', 2)[2] if len(request) > 2 else ''
+                if not self.refresh_search():
+                    return
+                with self.search_lock:
+                    matches = self.searcher.search(query, limit)
+                wfile.write(''.join(json.dumps(command) + '\n' for command in matches).encode('utf-8'))
+            elif request[0] == 'context':
+                commands = self.context_commands(line.split(' ', 2)[2], int(request[1]))
+                wfile.write(''.join(json.dumps(command) + '\n' for command in commands).encode('utf-8'))
+        except (IndexError, ValueError):
+            wfile.write(b"error Bad request\n")
+
+    def serve(self) -> int:
+        """Warm up, keep the index live and serve until interrupted"""
+        if not private_dir(self.socket_path.parent):
+            self.manager.show_error(f"Not serving from {self.socket_path.parent}: not a directory private to this user")
+            return 1
+        self.refresh()
+        threading.Thread(target=self.update_context, name='context-index', daemon=True).start()
+        self.focus.start()
+        for history_file in self.manager.history_files:
+            HistoryWatcher(history_file, self.history_changed).start()
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        import socketserver
+
+        class DaemonRequestHandler(socketserver.StreamRequestHandler):
+            def handle(handler):
+                if peer_uid(handler.connection) == os.getuid():  # Shell history is for its owner only
+                    self.handle(handler.rfile, handler.wfile)
+
+        old_umask = os.umask(0o077)  # The socket hands out shell history: owner only
+        try:
+            server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), DaemonRequestHandler)
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            try:
+                self.socket_path.unlink()
+            except OSError:
+                pass
+        return 0
+
+class DaemonClient:
+    """Client side of HistoryDaemon; requests return None when no daemon answers"""
+    def __init__(self, socket_path: Path = SOCKET_PATH):
+        self.socket_path = socket_path
+        self.generation = None
+        self.sort = SORT_ORDERS[0]
+
+    def request(self, line: str) -> Optional[socket.socket]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(0.5)
+            sock.connect(str(self.socket_path))
+            if peer_uid(sock) != os.getuid():
+                raise PermissionError(f"{self.socket_path} is served by another user")
+            sock.settimeout(None)
+            sock.sendall(line.encode('utf-8') + b'\n')
+            return sock
+        except OSError:
+            sock.close()
+            return None
+
+    def open_lines(self, sort: str, show_timestamps: bool,
+                   show_line_numbers: bool) -> Optional[Tuple[int, Iterator[bytes]]]:
+        """Request rendered lines; returns (count, chunk iterator) or raises RuntimeError on a daemon error"""
+        self.sort = sort
+        sock = self.request(f"lines {sort} {int(show_timestamps)} {int(show_line_numbers)}")
+        if sock is None:
+            return None
+        rfile = sock.makefile('rb')
+        header = rfile.readline().decode('utf-8', errors='ignore').rstrip('\n').split(' ', 2)
+        if header[0] != 'ok':
+            sock.close()
+            raise RuntimeError(header[-1])
+        self.generation = int(header[1])
+
+        def chunks():
+            with sock, rfile:
+                yield from iter(lambda: rfile.read1(65536), b'')
+        return int(header[2]), chunks()
+
+    def search(self, query: str, limit: int) -> Optional[List[str]]:
+        sock = self.request(f"search {limit} {query}")
+        if sock is None:
+            return None
+        with sock, sock.makefile('rb') as rfile:
+            return [json.loads(line) for line in rfile]
+
+    def context(self, directory: str, k: int) -> Optional[List[str]]:
+        sock = self.request(f"context {k} {directory}")
+        if sock is None:
+            return None
+        with sock, sock.makefile('rb') as rfile:
+            return [json.loads(line) for line in rfile]
+
+    def get_command(self, index: int) -> Optional[str]:
+        sock = self.request(f"command {self.generation} {self.sort} {index}")
+        if sock is None:
+            return None
+        with sock, sock.makefile('rb') as rfile:
+            data = rfile.read()
+        return data.decode('utf-8') if data else None
+
+class NvimClient:
+    """Just enough msgpack-RPC to drive a running Neovim (`nvim --listen ADDR`, or $NVIM inside it)"""
+    EDIT_LUA = """
+local chan, text = ...
+vim.cmd('tabnew')
+local buf = vim.api.nvim_get_current_buf()
+vim.bo[buf].buftype = 'acwrite'
+vim.bo[buf].bufhidden = 'wipe'
+vim.bo[buf].filetype = 'sh'
+vim.api.nvim_buf_set_name(buf, 'term-history://' .. buf)
+vim.api.nvim_buf_set_lines(buf, 0, -1, false, vim.split(text, '\\n'))
+vim.bo[buf].modified = false
+vim.api.nvim_create_autocmd('BufWriteCmd', {buffer = buf, callback = function()
+  vim.bo[buf].modified = false
+  vim.rpcnotify(chan, 'term_history_written', table.concat(vim.api.nvim_buf_get_lines(buf, 0, -1, false), '\\n'))
+  vim.schedule(function() pcall(vim.cmd, 'bwipeout ' .. buf) end)
+end})
+vim.api.nvim_create_autocmd('BufWipeout', {buffer = buf, callback = function()
+  vim.rpcnotify(chan, 'term_history_closed')
+end})
+"""
+
+    def __init__(self, address: str):
+        if ':' in address and not address.startswith('/'):
+            host, port = address.rsplit(':', 1)
+            self.sock = socket.create_connection((host, int(port)), timeout=1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(1)
+            self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+        self.msgid = 0
+        self.notifications = []
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    @classmethod
+    def pack(cls, obj) -> bytes:
+        if obj is None:
+            return b'\xc0'
+        if obj is True or obj is False:
+            return b'\xc3' if obj else b'\xc2'
+        if isinstance(obj, int):
+            if 0 <= obj < 0x80 or -32 <= obj < 0:
+                return struct.pack('b' if obj < 0 else 'B', obj)
+            return b'\xd3' + struct.pack('>q', obj)
+        if isinstance(obj, str):
+            data = obj.encode('utf-8')
+            return (bytes([0xa0 | len(data)]) if len(data) < 32 else b'\xdb' + struct.pack('>I', len(data))) + data
+        if isinstance(obj, bytes):
+            return b'\xc6' + struct.pack('>I', len(obj)) + obj
+        if isinstance(obj, (list, tuple)):
+            return b'\xdd' + struct.pack('>I', len(obj)) + b''.join(map(cls.pack, obj))
+        if isinstance(obj, dict):
+            return b'\xdf' + struct.pack('>I', len(obj)) + b''.join(
+                cls.pack(k) + cls.pack(v) for k, v in obj.items())
+        raise TypeError(f"cannot pack {type(obj).__name__}")
+
+    def read(self, n: int) -> bytes:
+        data = self.rfile.read(n)
+        if len(data) < n:
+            raise EOFError('nvim closed the connection')
+        return data
+
+    def unpack(self):
+        """Read one msgpack object; ext types (buffer/window handles) come back as their raw bytes"""
+        b = self.read(1)[0]
+        if b < 0x80 or b >= 0xe0:
+            return b if b < 0x80 else b - 0x100
+        if b <= 0x8f:
+            return {self.unpack(): self.unpack() for _ in range(b & 0x0f)}
+        if b <= 0x9f:
+            return [self.unpack() for _ in range(b & 0x0f)]
+        if b <= 0xbf:
+            return self.read(b & 0x1f).decode('utf-8', errors='replace')
+        if b in (0xc0, 0xc2, 0xc3):
+            return {0xc0: None, 0xc2: False, 0xc3: True}[b]
+        sized = {0xc4: ('B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+                 0xc7: ('B', 'ext'), 0xc8: ('>H', 'ext'), 0xc9: ('>I', 'ext'),
+                 0xd9: ('B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+                 0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'), 0xde: ('>H', 'map'), 0xdf: ('>I', 'map')}
+        if b in sized:
+            fmt, kind = sized[b]
+            n = struct.unpack(fmt, self.read(struct.calcsize(fmt)))[0]
+            if kind == 'array':
+                return [self.unpack() for _ in range(n)]
+            if kind == 'map':
+                return {self.unpack(): self.unpack() for _ in range(n)}
+            if kind == 'ext':
+                self.read(1)
+            data = self.read(n)
+            return data.decode('utf-8', errors='replace') if kind == 'str' else data
+        fixed = {0xca: '>f', 0xcb: '>d', 0xcc: 'B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+                 0xd0: 'b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'}
+        if b in fixed:
+            return struct.unpack(fixed[b], self.read(struct.calcsize(fixed[b])))[0]
+        if 0xd4 <= b <= 0xd8:  # fixext 1..16
+            return self.read(1 + (1 << (b - 0xd4)))[1:]
+        raise ValueError(f"bad msgpack byte {b:#x}")
+
+    def request(self, method: str, *args):
+        """Call an API method; notifications arriving meanwhile are queued for wait()"""
+        self.msgid += 1
+        self.sock.sendall(self.pack([0, self.msgid, method, list(args)]))
+        while True:
+            message = self.unpack()
+            if message[0] == 2:
+                self.notifications.append(message[1:])
+            elif message[0] == 1 and message[1] == self.msgid:
+                if message[2] is not None:
+                    raise RuntimeError(f"nvim: {message[2]}")
+                return message[3]
+
+    def wait(self, timeout: float) -> Tuple[str, list]:
+        """Next notification as (event, args)"""
+        self.sock.settimeout(timeout)
+        while not self.notifications:
+            message = self.unpack()
+            if message[0] == 2:
+                self.notifications.append(message[1:])
+        return tuple(self.notifications.pop(0))
+
+    def edit(self, text: str, timeout: float = 120) -> Optional[str]:
+        """Open text in a scratch tab; return it once written, or None if the tab is closed unwritten"""
+        channel = self.request('nvim_get_api_info')[0]
+        self.request('nvim_exec_lua', self.EDIT_LUA, [channel, text])
+        event, args = self.wait(timeout)
+        while event not in ('term_history_written', 'term_history_closed'):
+            event, args = self.wait(timeout)  # Someone else's rpcnotify on this channel
+        return args[0] if event == 'term_history_written' else None
+
+class Backends:
+    """Clipboard, terminal and editor commands resolved once and cached until the session changes
+
+    The probe runs only when PATH, the session type or $TERMINAL/$VISUAL/$EDITOR
+    differ from the cached run, or a cached executable has gone away.
+    """
+    VERSION = 1
+    CLIPBOARDS = {
+        'wayland': [['wl-copy'], ['xclip', '-selection', 'clipboard'], ['xsel', '--clipboard', '--input']],
+        'x11': [['xclip', '-selection', 'clipboard'], ['xsel', '--clipboard', '--input'], ['wl-copy']],
+    }
+    # Prefix that makes each terminal run the command after it
+    TERMINALS = {
+        'alacritty': ['-e'], 'kitty': ['-e'], 'wezterm': ['start', '--'], 'foot': ['-e'],
+        'gnome-terminal': ['--'], 'konsole': ['-e'], 'xterm': ['-e'], 'urxvt': ['-e'], 'st': ['-e'],
+        'x-terminal-emulator': ['-e'],
+    }
+    EDITORS = ['nvim']  # Then $VISUAL, $EDITOR and vi
+
+    def __init__(self):
+        self.path = CACHE_DIR / 'backends.json'
+        self.clipboard: Optional[List[str]] = None
+        self.terminal: Optional[List[str]] = None
+        self.editor: Optional[str] = None
+
+    @staticmethod
+    def session() -> str:
+        if os.environ.get('WAYLAND_DISPLAY') or os.environ.get('XDG_SESSION_TYPE') == 'wayland':
+            return 'wayland'
+        return 'x11'
+
+    def key(self) -> dict:
+        return {name: os.environ.get(name, '') for name in ('PATH', 'TERMINAL', 'VISUAL', 'EDITOR')} | {
+            'session': self.session(), 'version': self.VERSION}
+
+    @classmethod
+    def load(cls) -> 'Backends':
+        backends = cls()
+        try:
+            with open(backends.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['key'] == backends.key() and all(
+                    os.access(argv[0], os.X_OK) for argv in (data['clipboard'], data['terminal'], [data['editor']])
+                    if argv and argv[0]):
+                backends.clipboard, backends.terminal, backends.editor = (
+                    data['clipboard'], data['terminal'], data['editor'])
+                return backends
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        backends.probe()
+        return backends
+
+    def probe(self):
+        """Resolve each backend from $PATH and save the result"""
+        import shutil
+        for argv in self.CLIPBOARDS[self.session()]:
+            found = shutil.which(argv[0])
+            if found:
+                self.clipboard = [found] + argv[1:]
+                break
+
+        preferred = os.environ.get('TERMINAL', '')
+        for name in [preferred] * bool(preferred) + list(self.TERMINALS):
+            found = shutil.which(name)
+            if found:
+                self.terminal = [found] + self.TERMINALS.get(os.path.basename(name), ['-e'])
+                break
+
+        editors = self.EDITORS + [os.environ.get('VISUAL', ''), os.environ.get('EDITOR', ''), 'vi']
+        self.editor = next(filter(None, (shutil.which(editor) for editor in editors if editor)), None)
+
         try:
-            subprocess.run(['notify-send', 'History Menu', message], timeout=3, capture_output=True)
-        except:
-            pass  # Notifications are optional
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            temp_file = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            temp_file.write_text(json.dumps({'key': self.key(), 'clipboard': self.clipboard,
+                                             'terminal': self.terminal, 'editor': self.editor}), encoding='utf-8')
+            os.replace(temp_file, self.path)
+        except OSError:
+            pass  # Probing again next time is fine
+
+class MenuView:
+    """Rofi input for one sort and display combination, replayable each time rofi is re-opened"""
+    def __init__(self, chunks: Iterator[bytes]):
+        self.source = chunks
+        self.chunks: List[bytes] = []
+        self.state = None  # (store, entries, daemon generation) saved when another view takes over
+
+    def replay(self) -> Iterator[bytes]:
+        """Chunks rendered so far in one write, then the rest as the source produces them"""
+        if self.chunks:
+            yield b''.join(self.chunks)
+        for chunk in self.source:
+            self.chunks.append(chunk)
+            yield chunk
+
+    def finish(self):
+        for chunk in self.source:
+            self.chunks.append(chunk)
 
 class RofiHistoryMenu:
-    def __init__(self, show_timestamps: bool = True, show_line_numbers: bool = True, edit_mode: bool = False):
-        self.history_manager = HistoryManager()
+    MAX_COMMANDS = 1000
+    BATCH_LINES = 64  # Lines per write while streaming into rofi
+    ROFI_PRE_READ = 20  # Lines rofi reads before drawing: one screen plus a little
+    WINDOWS = (('last 24h', 86400), ('last 7 days', 7 * 86400), ('last 30 days', 30 * 86400))  # Besides all
+    WIDTH = 80  # Characters of a command shown per row
+    CONTEXT_COMMANDS = 5  # Commands used in the focused terminal's directory, listed first
+    CONTEXT_WAIT = 0.05  # How long the first screen waits for them
+
+    def __init__(self, show_timestamps: bool = True, show_line_numbers: bool = True, edit_mode: bool = False,
+                 use_daemon: bool = True, sort: str = 'frecency', merge_shells: bool = False,
+                 extra_files: Iterable[Path] = (), tracer: Optional[PhaseTracer] = None,
+                 nvim_address: Optional[str] = None, window: Tuple[Optional[int], Optional[int]] = (None, None),
+                 cwd: Optional[str] = None):
+        self.tracer = tracer or PhaseTracer()
+        self.history_manager = HistoryManager(merge_shells, extra_files)
+        self.history_manager.tracer = self.tracer
+        self.sort = sort
+        self.store = HistoryStore()
+        self.entries: List[int] = []  # Store rows in rofi order
+        self.loaded = False
+        self.view: Optional[MenuView] = None  # Current entry of views
+        self.views: Dict[tuple, MenuView] = {}  # By (sort, timestamps, line numbers, window)
+        self.remote = False  # Whether the current view came from the daemon
+        now = int(time.time())
+        # (label, since, until) cycled by Alt+W
+        self.windows = [('', None, None)] + [(label, now - seconds, None) for label, seconds in self.WINDOWS]
+        if window != (None, None):
+            fmt = HistoryManager.TIME_FORMAT
+            label = ' – '.join(time.strftime(fmt, time.localtime(edge)) if edge is not None else default
+                               for edge, default in zip(window, ('…', 'now')))
+            self.windows.insert(0, (label, *window))
+        self.window = 0
         self.show_timestamps = show_timestamps
         self.show_line_numbers = show_line_numbers
         self.edit_mode = edit_mode
+        self.nvim_address = nvim_address or os.environ.get('NVIM')  # Edit there instead of a new terminal
+        self.client = DaemonClient() if use_daemon else None
+        self.cwd = cwd  # Directory whose commands are boosted; found from the focused window if None
+        self.context: Optional[List[str]] = None  # Commands of the rows above the list, once looked up
+        self.context_lookup: Optional[Tuple[threading.Event, List[str]]] = None
+        self.lines: Dict[bool, LineCache] = {}  # By show_timestamps
         
+    def get_theme_args(self) -> List[str]:
+        """rofi arguments for the theme, written once to a file named after its contents"""
+        theme = self.get_rofi_theme()
+        theme_file = CACHE_DIR / f"theme-{zlib.crc32(theme.encode()):08x}.rasi"
+        if theme_file.exists():
+            return ['-theme', str(theme_file)]
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for stale in CACHE_DIR.glob('theme-*.rasi'):
+                stale.unlink(missing_ok=True)
+            temp_file = theme_file.with_suffix(f'.{os.getpid()}.tmp')
+            temp_file.write_text(theme, encoding='utf-8')
+            os.replace(temp_file, theme_file)
+        except OSError:
+            return ['-theme-str', theme]  # Cache dir not writable
+        return ['-theme', str(theme_file)]
+
     def get_rofi_theme(self) -> str:
         """Get Rofi theme configuration based on clipboard theme"""
         return """
@@ -413,114 +2604,79 @@ button selected {
 }
 """
     
+    @functools.cached_property
+    def backends(self) -> Backends:
+        return Backends.load()
+
+    @traced('clipboard')
     def copy_to_clipboard(self, text: str) -> bool:
-        """Copy text to clipboard using multiple methods"""
-        methods = [
-            # Try wl-copy first (Wayland)
-            lambda: subprocess.run(['wl-copy'], input=text, text=True, check=True, timeout=5),
-            # Then xclip (X11)
-            lambda: subprocess.run(['xclip', '-selection', 'clipboard'], input=text, text=True, check=True, timeout=5),
-            # Then xsel (X11 alternative)  
-            lambda: subprocess.run(['xsel', '--clipboard', '--input'], input=text, text=True, check=True, timeout=5),
-        ]
-        
-        for method in methods:
-            try:
-                method()
-                return True
-            except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                continue
-        
-        return False
+        """Copy text to the clipboard with the probed wl-copy, xclip or xsel"""
+        if not self.backends.clipboard:
+            return False
+        try:
+            subprocess.run(self.backends.clipboard, input=text, text=True, check=True, timeout=5)
+            return True
+        except (subprocess.CalledProcessError, OSError, subprocess.TimeoutExpired):
+            return False
     
+    @traced('type')
     def type_text(self, text: str) -> bool:
-        subprocess.run(['xdotool', 'key', 'ctrl+v', text], check=False, timeout=10),
-        return True
+        """Paste with ctrl+v; the clipboard must already hold text"""
+        return spawn(['xdotool', 'key', 'ctrl+v', text])
     
+    @traced('terminal')
     def run_in_terminal(self, command: str) -> bool:
         """Run command in a new terminal window"""
-        # List of terminal emulators to try, in order of preference
-        terminals = [
-            # Modern terminals with good support
-            ['alacritty', '-e', 'bash', '-c'],
-            ['kitty', '-e', 'bash', '-c'],
-            ['wezterm', 'start', '--', 'bash', '-c'],
-            ['foot', '-e', 'bash', '-c'],
-            
-            # Traditional terminals
-            ['gnome-terminal', '--', 'bash', '-c'],
-            ['konsole', '-e', 'bash', '-c'],
-            ['xterm', '-e', 'bash', '-c'],
-            ['urxvt', '-e', 'bash', '-c'],
-            ['st', '-e', 'bash', '-c'],
-            
-            # Fallback
-            ['x-terminal-emulator', '-e', 'bash', '-c'],
-        ]
+        if not self.backends.terminal:
+            return False
         
         # Create a command that runs the history command and keeps terminal open
         full_command = f'{command}; echo ""; echo "Press Enter to close..."; read'
-        
-        for term_cmd in terminals:
-            try:
-                subprocess.Popen(term_cmd + [full_command], 
-                               stdout=subprocess.DEVNULL, 
-                               stderr=subprocess.DEVNULL)
-                return True
-            except FileNotFoundError:
-                continue
-        
-        # If no terminal found, try with shell detection
-        shell = os.environ.get('SHELL', 'bash')
-        shell_name = shell.split('/')[-1]
-        
-        for term_cmd in terminals[:5]:  # Try only the modern ones
-            try:
-                cmd = term_cmd[:-2] + [shell_name, '-c'] 
-                subprocess.Popen(cmd + [full_command],
-                               stdout=subprocess.DEVNULL, 
-                               stderr=subprocess.DEVNULL)
-                return True
-            except FileNotFoundError:
-                continue
-                
-        return False
+        try:
+            subprocess.Popen(self.backends.terminal + ['bash', '-c', full_command],
+                           stdout=subprocess.DEVNULL, 
+                           stderr=subprocess.DEVNULL)
+            return True
+        except OSError:
+            return False
     
+    @traced('edit')
     def edit_command(self, command: str) -> Optional[str]:
-        """Edit command in nvim"""
-        editor = 'nvim'  # Force nvim as requested
+        """Edit command in the running nvim server, or in a new terminal when there is none"""
+        try:
+            client = NvimClient(self.nvim_address) if self.nvim_address else None
+        except OSError:
+            client = None  # Stale address: nobody is listening
+        if not client:
+            return self.edit_in_terminal(command)
+        try:
+            edited_command = client.edit(command)
+        except (OSError, EOFError, ValueError, RuntimeError) as e:
+            self.history_manager.show_error(f"Error editing command: {e}")
+            return None
+        finally:
+            client.close()
+        edited_command = (edited_command or '').strip()
+        return edited_command if edited_command and edited_command != command else None
+
+    def edit_in_terminal(self, command: str) -> Optional[str]:
+        """Edit command in nvim (or $VISUAL/$EDITOR when nvim is missing)"""
+        import tempfile
+        editor = self.backends.editor
+        if not editor:
+            self.history_manager.show_error("No editor found")
+            return None
         
         with tempfile.NamedTemporaryFile(mode='w', suffix='.sh', delete=False) as f:
             f.write(command)
             temp_file = f.name
         
         try:
-            # Open in terminal with nvim
-            terminal_cmd = None
-            terminals = [
-                ['alacritty', '-e'],
-                ['kitty', '-e'], 
-                ['wezterm', '-e'],
-                ['foot', '-e'],
-                ['gnome-terminal', '--'],
-                ['konsole', '-e'],
-                ['xterm', '-e'],
-            ]
-            
-            for term_cmd in terminals:
-                try:
-                    subprocess.run(term_cmd + [editor, temp_file], check=True, timeout=120)
-                    terminal_cmd = term_cmd
-                    break
-                except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                    continue
-            
-            if not terminal_cmd:
-                # Fallback to direct nvim call
-                try:
-                    subprocess.run([editor, temp_file], timeout=120)
-                except subprocess.TimeoutExpired:
-                    pass
+            # Open in a terminal, or run the editor directly without one
+            try:
+                subprocess.run((self.backends.terminal or []) + [editor, temp_file], timeout=120)
+            except subprocess.TimeoutExpired:
+                pass
             
             # Read the edited content
             with open(temp_file, 'r') as f:
@@ -538,148 +2694,296 @@ button selected {
             except:
                 pass
     
-    def show_help(self) -> str:
+    def show_help(self, full: bool = False) -> str:
         """Return help message"""
-        help_text = """Enter: Obvious | Alt+E: Edit | Alt+Return: Run | Alt+C: Copy | Esc: Exit""".strip()
+        help_text = """Enter: Obvious | Alt+E: Edit | Alt+Return: Run | Alt+C: Copy | F1: Help | Esc: Exit""".strip()
+        if full:
+            help_text = (f"Enter: Copy + Type | Alt+E: Edit, :w to use it | Alt+Return: Run in terminal | Alt+C: Copy\n"
+                         f"Alt+S: Sort ({self.sort}) | Alt+W: Time window | Alt+N: Line numbers | "
+                         f"Alt+T: Timestamps | Esc: Exit")
         return help_text
     
-    def run(self) -> int:
-        """Run the Rofi history menu"""
-        if not self.history_manager.load_history():
-            return 1
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        """Fuzzy matches over the whole history, answered by the daemon when one is running"""
+        if self.client:
+            matches = self.client.search(query, limit)
+            if matches is not None:
+                return matches
+        if not self.history_manager.load_history(0):
+            return []
+        return self.history_manager.search(query, limit)
+
+    def load_entries(self) -> Optional[Iterator[bytes]]:
+        """Return rofi input chunks, served by the history daemon when one is running"""
+        if self.client:
+            try:
+                served = self.client.open_lines(self.sort, self.show_timestamps, self.show_line_numbers)
+            except RuntimeError as e:
+                self.history_manager.show_error(str(e))
+                return None
+            if served:
+                self.loaded = self.remote = True
+                return served[1]
+            self.client = None  # No daemon: parse locally
+
+        self.remote = False
+
+        return self.stream_entries()
+
+    def format_batch(self, rows: List[int]) -> bytes:
+        lines = self.lines.get(self.show_timestamps)
+        if lines is None:
+            lines = self.lines[self.show_timestamps] = LineCache(self.show_timestamps, self.WIDTH)
+        return ''.join(
+            self.history_manager.format_command_for_rofi(
+                self.store, row, self.show_timestamps, self.show_line_numbers, self.WIDTH, lines) + '\n'
+            for row in rows).encode('utf-8')
+
+    def stream_entries(self) -> Iterator[bytes]:
+        """Parse in the background and yield formatted lines batch by batch
+
+        On a cold start in recency order without line numbers, commands are yielded
+        while the newest-first reader is still walking back through the file, so
+        rofi can draw the first screen before the rest is parsed. Frecency order
+        is only known once every use has been counted, and line numbers count
+        from the oldest loaded command, so with either the whole parse comes first.
+        """
+        self.store = HistoryStore()
+        self.entries = []
+        found = queue.Queue()
+        streaming = self.sort == 'recent' and not self.show_line_numbers
+
+        def load():
+            try:
+                self.loaded = self.history_manager.load_history(
+                    self.MAX_COMMANDS, (lambda *entry: found.put(entry)) if streaming else None)
+            finally:
+                found.put(None)
+        threading.Thread(target=load, name='history-loader', daemon=True).start()
+
+        entry = found.get()
+        while entry is not None:
+            batch = []
+            while entry is not None:
+                command, timestamp = entry
+                batch.append(self.store.append(command, timestamp, 0))  # Not shown while streaming
+                if len(batch) >= self.BATCH_LINES or found.empty():
+                    break
+                entry = found.get()
+            self.entries.extend(batch)
+            yield self.format_batch(batch)
+            if entry is not None:
+                entry = found.get()
+
+        if not self.entries and self.loaded:
+            # Served from the cache: everything is ready at once, so it goes in one write
+            self.store = self.history_manager.store
+            self.entries = self.history_manager.ordered(self.sort)
+            yield from self.render(self.entries)
+
+    @traced('lookup')
+    def get_command(self, index: int) -> str:
+        """Command behind the rofi row at index"""
+        if index < 0:
+            raise IndexError(index)
+        context = self.context or []
+        if index < len(context):
+            return context[index]
+        index -= len(context)
+        if self.remote:
+            command = self.client.get_command(index)
+            if command is None:
+                raise IndexError(index)
+            return command
+        return self.store.command(self.entries[index])
+
+    def run_rofi(self, rofi_cmd: List[str], chunks: Iterable[bytes]) -> Tuple[int, str]:
+        """Feed chunks to rofi's stdin and wait for the selection"""
+        with self.tracer.phase('rofi_spawn'):
+            process = subprocess.Popen(rofi_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+        started = time.monotonic()
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+                process.stdin.flush()
+        except BrokenPipeError:
+            pass  # rofi exited before reading everything
+        self.tracer.add('rofi_feed', started)
+        try:
+            stdout, _ = process.communicate(timeout=300)  # 5 minute timeout
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            self.tracer.add('rofi_open', started)  # Includes the time spent choosing
+        return process.returncode, stdout.decode('utf-8', errors='ignore')
+
+    def start_context(self):
+        """Look up the commands used in the focused terminal's directory while the history loads"""
+        done, found = threading.Event(), []
+
+        def lookup():
+            try:
+                directory = self.cwd or focused_cwd()
+                if directory:
+                    # The daemon keeps the path indexes warm; reading them here is the fallback
+                    commands = self.client and self.client.context(directory, self.CONTEXT_COMMANDS)
+                    if commands is None:
+                        commands = self.history_manager.directory_commands(directory, self.CONTEXT_COMMANDS)
+                    found.extend(commands)
+            except Exception:
+                pass  # Plain ranking without them
+            finally:
+                done.set()
+        threading.Thread(target=lookup, name='context-lookup', daemon=True).start()
+        self.context_lookup = (done, found)
+
+    def with_context(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """chunks, after rows for the commands used in the focused terminal's directory"""
+        if self.context:
+            yield ''.join(f"📂 {pango_escape(self.history_manager.shorten(command, self.WIDTH))}\n"
+                          for command in self.context).encode('utf-8')
+        yield from chunks
+
+    def open_view(self) -> Optional[MenuView]:
+        """Make the view for the current sort and display options current, rendering it at most once"""
+        if self.context is None:
+            # Settled once, so every view has the same rows on top
+            done, found = self.context_lookup or (None, [])
+            self.context = list(found) if done and done.wait(self.CONTEXT_WAIT) else []
+        _, since, until = self.windows[self.window]
+        key = (self.sort, self.show_timestamps, self.show_line_numbers, since, until)
+        if self.view is not None:
+            self.view.finish()  # Keeps its lookup state consistent once we switch away
+            self.view.state = (self.store, self.entries, self.remote, self.client and self.client.generation)
+        view = self.views.get(key)
+        if view is not None:
+            self.store, self.entries, self.remote, generation = view.state
+            if self.remote:
+                self.client.generation, self.client.sort = generation, self.sort
+        elif since is not None or until is not None:
+            # Time windows are read locally, straight from the indexed part of the file
+            self.store, frecency = self.history_manager.load_window(since, until, self.MAX_COMMANDS)
+            self.entries = self.history_manager.ordered(self.sort, self.store, frecency)
+            self.remote = False
+            view = self.views[key] = MenuView(self.with_context(self.render(self.entries)))
+        elif self.loaded and not self.remote:
+            # Already parsed: only the formatting differs
+            self.store = self.history_manager.store
+            self.entries = self.history_manager.ordered(self.sort)
+            view = self.views[key] = MenuView(self.with_context(self.render(self.entries)))
+        else:
+            chunks = self.load_entries()
+            if chunks is None:
+                return None
+            view = self.views[key] = MenuView(self.with_context(chunks))
+        self.view = view
+        return view
+
+    def render(self, rows: List[int]) -> Iterator[bytes]:
+        """All rows as one chunk, rendered when rofi first asks for it"""
+        if rows:
+            yield self.format_batch(rows)
+
+    def rofi_command(self, theme_args: List[str], full_help: bool, query: str, selected: int) -> List[str]:
+        rofi_cmd = [
+            'rofi',
+            '-dmenu',
+            *theme_args,
+            '-p', ' · '.join(filter(None, ['📜 History', self.windows[self.window][0]])),
+            '-format', 'i f',  # Return index, then the typed filter so re-entry can restore it
+            '-i',  # Case insensitive
+            '-markup-rows',
+            '-async-pre-read', str(self.ROFI_PRE_READ),
+            '-kb-custom-1', 'Alt+e',     # Edit command
+            '-kb-custom-2', 'Alt+Return',     # Run in new terminal
+            '-kb-custom-3', 'Alt+c',     # Copy only
+            '-kb-custom-4', 'F1',        # Help
+            '-kb-custom-5', 'Alt+s',     # Toggle sort order
+            '-kb-custom-6', 'Alt+n',     # Toggle line numbers
+            '-kb-custom-7', 'Alt+t',     # Toggle timestamps
+            '-kb-custom-8', 'Alt+w',     # Cycle time windows
+            '-kb-accept-entry', 'Return',
+            '-kb-cancel', 'Escape,Super_L+colon',
+            '-lines', '10',
+            '-width', '900',
+            '-columns', '1',
+            '-selected-row', str(max(selected, 0)),
+        ]
+        if query:
+            rofi_cmd.extend(['-filter', query])
         
-        if not self.history_manager.commands:
-            self.history_manager.show_error("No commands found in history")
+        # Show help message
+        help_msg = self.show_help(full_help)
+        rofi_cmd.extend(['-mesg', help_msg])
+        return rofi_cmd
+
+    def run(self, resume: Optional[Tuple[int, str, Optional[str]]] = None) -> int:
+        """Run the Rofi history menu until a command is used or the menu is cancelled
+
+        Help, display toggles and cancelled edits re-open rofi from the views kept
+        in memory, so re-entering parses nothing and writes no files. resume is
+        (return code, rofi output, command) of a rofi session term-history-launch.py
+        already ran, acted on before rofi is shown again.
+        """
+        started = time.monotonic()
+        self.start_context()
+        view = self.open_view()
+        if view is None:
+            return 1
+
+        # Wait for the first batch only; the rest is written while rofi is up
+        first = next(view.replay(), None)
+        self.tracer.add('first_batch', started)
+        if first is None:
+            if self.loaded or self.window:
+                self.history_manager.show_error("No commands found in history")
             return 1
         
-        # Prepare Rofi input
-        rofi_input = []
-        for cmd in self.history_manager.commands:
-            formatted = self.history_manager.format_command_for_rofi(
-                cmd, self.show_timestamps, self.show_line_numbers)
-            rofi_input.append(formatted)
-        
-        # Write theme to temp file
-        theme_file = None
         try:
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.rasi', delete=False) as f:
-                f.write(self.get_rofi_theme())
-                theme_file = f.name
-            
-            # Prepare Rofi command
-            rofi_cmd = [
-                'rofi',
-                '-dmenu',
-                '-theme', theme_file,
-                '-p', '📜 History',
-                '-format', 'i',  # Return index
-                '-i',  # Case insensitive
-                '-markup-rows',
-                '-kb-custom-1', 'Alt+e',     # Edit command
-                '-kb-custom-2', 'Alt+Return',     # Run in new terminal
-                '-kb-custom-3', 'Alt+c',     # Copy only
-                '-kb-custom-4', 'F1',        # Help
-                '-kb-accept-entry', 'Return',
-                '-kb-cancel', 'Escape,Super_L+colon',
-                '-lines', '10',
-                '-width', '900',
-                '-columns', '1',
-            ]
+            with self.tracer.phase('theme'):
+                theme_args = self.get_theme_args()
             
-            # Show help message
-            help_msg = self.show_help()
-            rofi_cmd.extend(['-mesg', help_msg])
-            
-            # Run Rofi
-            process = subprocess.run(
-                rofi_cmd,
-                input='\n'.join(rofi_input),
-                text=True,
-                capture_output=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if process.returncode == 0:
-                # Normal selection - Copy and Type instantly
-                try:
-                    index = int(process.stdout.strip())
-                    selected_command = self.history_manager.commands[index]['command']
-                    
-                    # Copy to clipboard
-                    copy_success = self.copy_to_clipboard(selected_command)
-                    
-                    type_success = self.type_text(selected_command)
-                    
-                    if copy_success and type_success:
-                        self.history_manager.show_notification("Executed")
-                    elif copy_success:
-                        self.history_manager.show_notification("Copied")
-                    elif type_success:
-                        self.history_manager.show_notification("Typed")
-                    else:
-                        self.history_manager.show_error("❌")
-                        
-                except (ValueError, IndexError):
-                    self.history_manager.show_error("Invalid selection")
-                    return 1
-                    
-            elif process.returncode == 10:
-                # Alt+E pressed - Edit mode
-                try:
-                    index = int(process.stdout.strip()) 
-                    selected_command = self.history_manager.commands[index]['command']
-                    
-                    edited_command = self.edit_command(selected_command)
-                    if edited_command:
-                        copy_success = self.copy_to_clipboard(edited_command)
-                        type_success = self.type_text(edited_command)
-                        
-                        if copy_success and type_success:
-                            self.history_manager.show_notification("Edited, Copied & Typed")
-                        else:
-                            self.history_manager.show_error("❌")
-                            
-                except (ValueError, IndexError):
-                    self.history_manager.show_error("Invalid selection for editing")
-                    return 1
-                    
-            elif process.returncode == 11:
-                # Alt+Return pressed - Run in terminal
-                try:
-                    index = int(process.stdout.strip())
-                    selected_command = self.history_manager.commands[index]['command']
-                    
-                    if self.run_in_terminal(selected_command):
-                        self.history_manager.show_notification("Running in terminal")
-                    else:
-                        self.history_manager.show_error("❌")
-                        
-                except (ValueError, IndexError):
-                    self.history_manager.show_error("Invalid selection for terminal execution")
-                    return 1
-                    
-            elif process.returncode == 12:
-                # Alt+C pressed - Copy only
-                try:
-                    index = int(process.stdout.strip())
-                    selected_command = self.history_manager.commands[index]['command']
-                    
-                    if self.copy_to_clipboard(selected_command):
-                        self.history_manager.show_notification("Copied")
+            full_help = False
+            query, selected = '', 0
+            while True:
+                if resume:
+                    (returncode, stdout, command), resume = resume, None
+                else:
+                    command = None
+                    returncode, stdout = self.run_rofi(
+                        self.rofi_command(theme_args, full_help, query, selected), view.replay())
+                index, _, query = stdout.rstrip('\n').partition(' ')
+                selected = int(index) if index.lstrip('-').isdigit() else 0
+                full_help = False
+
+                if returncode == 13:
+                    # F1 pressed - Show the full key list
+                    full_help = True
+                    continue
+                if returncode in (14, 15, 16, 17):
+                    # Alt+S/N/T/W pressed - Toggle sort order, line numbers, timestamps or time window
+                    if returncode == 14:
+                        self.sort = SORT_ORDERS[(SORT_ORDERS.index(self.sort) + 1) % len(SORT_ORDERS)]
+                        selected = 0
+                    elif returncode == 17:
+                        self.window = (self.window + 1) % len(self.windows)
+                        selected = 0
+                    elif returncode == 15:
+                        self.show_line_numbers = not self.show_line_numbers
                     else:
-                        self.history_manager.show_error("❌")
-                        
-                except (ValueError, IndexError):
-                    self.history_manager.show_error("Invalid selection")
-                    return 1
-                    
-            elif process.returncode == 13:
-                # F1 pressed - Show help (already shown in mesg)
-                return self.run()  # Restart to show help
-                
-            else:
-                # User cancelled or error
-                return process.returncode if process.returncode != 1 else 0
+                        self.show_timestamps = not self.show_timestamps
+                    view = self.open_view()
+                    if view is None:
+                        return 1
+                    continue
+
+                result = self.act(returncode, index, command)
+                if result is not None:
+                    return result
+                # Edit cancelled: back to the list where it was
                 
         except subprocess.TimeoutExpired:
             self.history_manager.show_error("Operation timed out")
@@ -688,15 +2992,193 @@ button selected {
             self.history_manager.show_error(f"Unexpected error: {e}")
             return 1
         finally:
-            # Clean up theme file
-            if theme_file:
-                try:
-                    os.unlink(theme_file)
-                except:
-                    pass
+            for lines in self.lines.values():
+                lines.save()
+
+    def act(self, returncode: int, index: str, command: Optional[str] = None) -> Optional[int]:
+        """Carry out the action for rofi's return code on command, or the row at index; None means show the list again"""
+        if returncode == 0:
+            # Normal selection - Copy and Type instantly
+            try:
+                selected_command = command or self.get_command(int(index))
+                
+                # The clipboard must be ready before ctrl+v; the rest runs detached
+                if not self.copy_to_clipboard(selected_command):
+                    self.history_manager.show_error("❌")
+                elif self.type_text(selected_command):
+                    self.history_manager.show_notification("Executed")
+                else:
+                    self.history_manager.show_notification("Copied")
+                    
+            except (ValueError, IndexError):
+                self.history_manager.show_error("Invalid selection")
+                return 1
+                
+        elif returncode == 10:
+            # Alt+E pressed - Edit mode
+            try:
+                selected_command = command or self.get_command(int(index))
+                
+                edited_command = self.edit_command(selected_command)
+                if not edited_command:
+                    return None  # Unchanged or abandoned: back to the list
+                if self.copy_to_clipboard(edited_command) and self.type_text(edited_command):
+                    self.history_manager.show_notification("Edited, Copied & Typed")
+                else:
+                    self.history_manager.show_error("❌")
+                        
+            except (ValueError, IndexError):
+                self.history_manager.show_error("Invalid selection for editing")
+                return 1
+                
+        elif returncode == 11:
+            # Alt+Return pressed - Run in terminal
+            try:
+                selected_command = command or self.get_command(int(index))
+                
+                if self.run_in_terminal(selected_command):
+                    self.history_manager.show_notification("Running in terminal")
+                else:
+                    self.history_manager.show_error("❌")
+                    
+            except (ValueError, IndexError):
+                self.history_manager.show_error("Invalid selection for terminal execution")
+                return 1
+                
+        elif returncode == 12:
+            # Alt+C pressed - Copy only
+            try:
+                selected_command = command or self.get_command(int(index))
+                
+                if self.copy_to_clipboard(selected_command):
+                    self.history_manager.show_notification("Copied")
+                else:
+                    self.history_manager.show_error("❌")
+                    
+            except (ValueError, IndexError):
+                self.history_manager.show_error("Invalid selection")
+                return 1
+                
+        else:
+            # User cancelled or error
+            return returncode if returncode != 1 else 0
         
         return 0
 
+class RofiScriptMode:
+    """Backend for rofi's script mode, searching the whole history
+
+    Use as: rofi -show history -modi "history:term-history.py --rofi-script"
+
+    rofi does not hand scripts each keystroke, so it filters the listed rows
+    itself; Enter on typed text that matches no row asks this script for fuzzy
+    matches over the whole history, which then replace the list.
+
+    The history is listed a page at a time: the last row (or kb-custom-1,
+    Alt+1 by default) replaces the list with the next, older page, so rofi
+    only ever holds PAGE rows while the whole archive stays reachable.
+    """
+    PAGE = 200
+
+    def __init__(self, menu: RofiHistoryMenu, limit: int = 50):
+        self.menu = menu
+        self.limit = limit
+
+    def run(self, selection: Optional[str]) -> int:
+        retv = int(os.environ.get('ROFI_RETV', '0'))
+        info = json.loads(os.environ['ROFI_INFO']) if os.environ.get('ROFI_INFO') else None
+        if retv == 1 and isinstance(info, dict):
+            return self.print_page(info['page'])
+        if retv == 1 and info is not None:
+            return self.select(info)
+        if retv == 2 and selection:
+            self.print_rows(self.menu.search(selection, self.limit), f"Matches for: {pango_escape(selection)}",
+                            query=selection)
+            return 0
+        if retv == 10:
+            return self.print_page(int(os.environ.get('ROFI_DATA') or -1) + 1)
+        return self.print_page(0)
+
+    def page(self, number: int) -> Tuple[List[str], bool]:
+        """Commands on page number and whether there are older ones
+
+        Pages follow the menu's own list (the newest MAX_COMMANDS unique
+        commands, cached, in the menu's sort order) and then carry on past it
+        newest first, reading back through the history files only as far as
+        the requested page.
+        """
+        manager = self.menu.history_manager
+        window = []
+        if manager.load_history(self.menu.MAX_COMMANDS):
+            window = [manager.store.command(row) for row in manager.ordered(self.menu.sort)]
+        start = number * self.PAGE
+        commands = window[start:start + self.PAGE + 1]
+        if len(commands) <= self.PAGE and len(window) == self.menu.MAX_COMMANDS:
+            seen = set(window)
+            older = (command for command, _ in manager.iter_unique() if command not in seen)
+            skip = max(0, start - len(window))
+            commands += itertools.islice(older, skip, skip + self.PAGE + 1 - len(commands))
+        return commands[:self.PAGE], len(commands) > self.PAGE
+
+    def print_page(self, number: int) -> int:
+        commands, more = self.page(number)
+        message = "Type and press Enter to search the whole history"
+        if number:
+            message = f"Page {number + 1} · {message}"
+        self.print_rows(commands, message, number, more)
+        return 0
+
+    def print_rows(self, commands: List[str], message: str, page: Optional[int] = None,
+                   more: bool = False, query: Optional[str] = None):
+        """Rows as Pango markup, with the characters matching query in bold"""
+        rows = [f"\0prompt\x1f📜 History", f"\0message\x1f{message}", "\0use-hot-keys\x1ftrue",
+                "\0markup-rows\x1ftrue"]
+        if page is not None:
+            rows.append(f"\0data\x1f{page}")
+        if page:
+            rows.append(f"⏫ Newer commands\0info\x1f{json.dumps({'page': page - 1})}")
+        for command in commands:
+            text = self.menu.history_manager.shorten(command, self.menu.WIDTH)
+            text = highlight(text, query) if query else pango_escape(text)
+            rows.append(f"{text}\0info\x1f{json.dumps(command)}")
+        if more:
+            rows.append(f"⏬ Load more (older commands)\0info\x1f{json.dumps({'page': page + 1})}")
+        sys.stdout.write('\n'.join(rows) + '\n')
+
+    def select(self, command: str) -> int:
+        """Copy the command, then paste it once rofi has closed and focus is back"""
+        if not self.menu.copy_to_clipboard(command):
+            self.menu.history_manager.show_error("❌")
+            return 1
+        spawn(['sh', '-c', 'sleep 0.2; exec xdotool key ctrl+v'])
+        return 0
+
+def parse_when(text: str) -> int:
+    """Epoch for --since/--until"""
+    value = text.strip().lower()
+    if value.isdigit():
+        return int(value)
+    now = time.time()
+    m = re.fullmatch(r'(\d+)\s*([smhdw])(?:\s+ago)?', value)
+    if m:
+        return int(now - int(m.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}[m.group(2)])
+
+    local = time.localtime(now)
+    def midnight(days_ago: int) -> int:
+        return int(time.mktime((local.tm_year, local.tm_mon, local.tm_mday - days_ago, 0, 0, 0, 0, 0, -1)))
+    weekdays = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    day = value.removeprefix('last ')
+    if value in ('today', 'yesterday'):
+        return midnight(int(value == 'yesterday'))
+    if day in weekdays:
+        return midnight((local.tm_wday - weekdays.index(day)) % 7 or 7)
+
+    from datetime import datetime
+    try:
+        return int(datetime.fromisoformat(text.strip()).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"unrecognised time: {text!r}")
+
 def main():
     parser = argparse.ArgumentParser(
         description='🚀 Rofi Terminal History Menu - Beautiful history browser with instant actions',
@@ -706,15 +3188,36 @@ Examples:
   %(prog)s                    # Launch with timestamps and line numbers
   %(prog)s --no-timestamps    # Hide timestamps
   %(prog)s --no-line-numbers  # Hide line numbers
+  %(prog)s --sort recent      # Most recently used first instead of frecency
+  %(prog)s --sort recent --no-line-numbers   # Rows appear while an uncached history is still parsed
+  %(prog)s --since "last tuesday" --until yesterday   # Only commands run in that window
+  %(prog)s --all-shells       # Merge fish, zsh and bash history into one list
+  %(prog)s --cwd ~/src/app    # List commands used there first (default: the focused terminal's directory, fish only)
   %(prog)s --edit-mode        # Start in edit mode
+  %(prog)s --daemon           # Keep history warm in the background (e.g. exec from i3)
+  %(prog)s --query "gco"      # Print the best fuzzy matches over the whole history
+  %(prog)s stats              # Top commands/executables/paths and usage by hour, weekday and day
+  %(prog)s --trace            # Log per-phase timings to ~/.cache/term-history/trace.jsonl
+  %(prog)s --trace-summary    # Print p50/p95 per phase over the logged runs
+  rofi -show history -modi "history:%(prog)s --rofi-script"   # Paged; Alt+1 or the last row loads more
 
 Keyboard Shortcuts:
   ENTER         Copy to clipboard + Type instantly
-  Alt+E         Edit command in nvim
+  Alt+E         Edit command in nvim (in the running one with --nvim or $NVIM, :w to accept)
   Alt+Enter     Run in new terminal window
   Alt+C         Copy to clipboard only
+  Alt+S         Toggle frecency / recent order
+  Alt+W         Cycle time windows (--since/--until, all, 24h, 7 days, 30 days)
+  Alt+N / Alt+T Toggle line numbers / timestamps
   F1            Show help
   Escape        Cancel and exit
+
+Ignored Commands:
+  Trivial commands (ls, cd, pwd, ...) and likely secrets (auth headers, exported
+  *_KEY/TOKEN/SECRET/PASSWORD, --password/--token flags, API token shapes) never
+  reach the menu or clipboard. Add rules in ~/.config/term-history/ignore, one per line:
+    git push --force        the command and any starting with these words
+    re:^ssh .*@prod         a regular expression searched anywhere (scope flags: (?i:...))
         """
     )
     
@@ -724,24 +3227,118 @@ Keyboard Shortcuts:
                        help='Hide line numbers in command list')
     parser.add_argument('--edit-mode', action='store_true', 
                        help='Start in edit mode (for power users)')
+    parser.add_argument('--sort', choices=SORT_ORDERS, default=SORT_ORDERS[0],
+                       help='Order by frecency (frequent and recent uses first) or by last use. Without a '
+                            'cache or daemon, only recent order with --no-line-numbers shows rows before '
+                            'the parse finishes')
+    parser.add_argument('--since', type=parse_when, metavar='WHEN',
+                       help='Only commands run since WHEN: epoch, ISO date/time, 3h/2d/1w (ago), '
+                            'today, yesterday or a weekday ("last tuesday")')
+    parser.add_argument('--until', type=parse_when, metavar='WHEN',
+                       help='Only commands run until WHEN (same formats as --since)')
+    parser.add_argument('--all-shells', action='store_true',
+                       help='Merge every shell history file found (and $TERM_HISTORY_FILES) newest first')
+    parser.add_argument('--history-file', action='append', type=Path, default=[], metavar='PATH',
+                       help='Extra history file to merge with --all-shells (repeatable)')
+    parser.add_argument('--cwd', metavar='DIR',
+                       help="List the commands most used on paths under DIR first (default: the focused "
+                            "terminal's directory; needs fish, which records path arguments)")
+    parser.add_argument('--daemon', action='store_true',
+                       help='Serve pre-rendered history over a Unix socket instead of showing the menu')
+    parser.add_argument('--no-daemon', action='store_true',
+                       help='Parse history locally even if a daemon is running')
+    parser.add_argument('--nvim', metavar='ADDR',
+                       help='Edit in the Neovim started with `nvim --listen ADDR` (default: $NVIM)')
+    parser.add_argument('--query', metavar='STR',
+                       help='Print the best fuzzy matches for STR over the whole history and exit')
+    parser.add_argument('--limit', type=int, default=20, metavar='K',
+                       help='Number of matches printed by --query, or rows per ranking by stats (default: 20)')
+    parser.add_argument('--rofi-script', action='store_true',
+                       help='Act as a rofi script-mode backend (see examples)')
+    parser.add_argument('--trace', nargs='?', type=Path, const=TRACE_LOG, metavar='LOG',
+                       help=f'Append per-phase timings of this run to LOG (default: {TRACE_LOG})')
+    parser.add_argument('--trace-summary', nargs='?', type=Path, const=TRACE_LOG, metavar='LOG',
+                       help='Print p50/p95 per phase across the runs in LOG and exit')
+    parser.add_argument('rofi_selection', nargs='?', help=argparse.SUPPRESS)  # Also the `stats` subcommand
+    # Set by term-history-launch.py when a key it does not handle closed the rofi it ran
+    parser.add_argument('--resume', metavar='"CODE OUTPUT"', help=argparse.SUPPRESS)
+    parser.add_argument('--resume-command', metavar='COMMAND', help=argparse.SUPPRESS)
     parser.add_argument('--version', action='version', version='%(prog)s 2.0')
     
-    args = parser.parse_args()
+    argv = sys.argv[1:]
+    selection = None
+    if ('--rofi-script' in argv and os.environ.get('ROFI_RETV', '0') != '0'
+            and argv.index('--rofi-script') < len(argv) - 1):
+        # rofi appends the chosen or typed text, which may look like an option (-rf, --force)
+        argv, selection = argv[:-1], argv[-1]
+    args = parser.parse_args(argv)
+    if selection is not None:
+        args.rofi_selection = selection
     
+    if args.trace_summary:
+        try:
+            print(PhaseTracer.summarize(args.trace_summary))
+        except OSError as e:
+            print(f"❌ Cannot read trace log: {e}")
+            return 1
+        return 0
+    if args.rofi_selection == 'stats' and not args.rofi_script:
+        manager = HistoryManager(merge_shells=args.all_shells, extra_files=args.history_file)
+        stats = [HistoryStats(path) for path in manager.history_files if path.exists()]
+        if not stats:
+            print(f"❌ History file not found: {manager.history_file}")
+            return 1
+        for item in stats:
+            item.update()
+        print(HistoryStats.report(stats, args.limit))
+        return 0
+    if args.rofi_selection and not args.rofi_script:
+        parser.error(f"unknown command: {args.rofi_selection}")
+    if args.daemon:
+        return HistoryDaemon(merge_shells=args.all_shells, extra_files=args.history_file).serve()
+
     menu = RofiHistoryMenu(
         show_timestamps=not args.no_timestamps,
         show_line_numbers=not args.no_line_numbers,
-        edit_mode=args.edit_mode
+        edit_mode=args.edit_mode,
+        use_daemon=not args.no_daemon,
+        sort=args.sort,
+        merge_shells=args.all_shells,
+        extra_files=args.history_file,
+        tracer=PhaseTracer(args.trace),
+        nvim_address=args.nvim,
+        window=(args.since, args.until),
+        cwd=args.cwd
     )
+    menu.tracer.add('imports', STARTED, IMPORTED)
+    menu.tracer.add('startup', IMPORTED)
     
-    return menu.run()
+    if args.query is not None:
+        for command in menu.search(args.query, args.limit):
+            print(command)
+        return 0
+    if args.rofi_script:
+        return RofiScriptMode(menu).run(args.rofi_selection)
 
-if __name__ == '__main__':
+    resume = None
+    if args.resume:
+        code, _, output = args.resume.partition(' ')
+        resume = (int(code), output, args.resume_command or None)
     try:
-        sys.exit(main())
+        return menu.run(resume)
+    finally:
+        menu.tracer.write(sort=menu.sort, daemon=menu.client is not None)
+
+def launch() -> int:
+    """main() behind the top-level error handling, shared with term-history-launch.py"""
+    try:
+        return main()
     except KeyboardInterrupt:
         print("\n🚫 Cancelled by user")
-        sys.exit(130)
+        return 130
     except Exception as e:
         print(f"❌ Fatal error: {e}")
-        sys.exit(1)
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(launch())
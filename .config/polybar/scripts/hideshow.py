@@ -22,22 +22,149 @@
 
 from i3ipc import Connection
 from subprocess import call
+from threading import Lock, Timer
+import os
+import socket
+import struct
 
 i3 = Connection()
 
+DEBOUNCE = 0.05     # Seconds a burst of events gets to settle before the bar is updated
+
+#   polybar (3.6+) listens on a socket per bar. A message is a header - magic,
+#   version 0, payload size and type 0 for commands - then the command itself.
+IPC_DIR = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'polybar') if os.environ.get('XDG_RUNTIME_DIR') \
+        else f'/tmp/polybar-{os.getuid()}'
+
+#   Windows per workspace, keyed by con id so renames don't matter. Kept up to
+#   date from the event payloads; get_tree() is only used to start over.
+windows = {}        # Workspace id -> ids of the windows on it
+workspaceOf = {}    # Window id -> workspace id
+focused = None      # Id of the focused workspace
+
+wanted = None       # Bar state for the windows as they are now
+lastSent = None     # Bar state polybar was last told
+timer = None        # Pending flush() while a burst settles
+lock = Lock()
+sending = Lock()    # Keeps sends in order if one is slow
+
+#   Changes that don't move windows between workspaces
+QUIET_WINDOW_CHANGES = { 'title', 'urgent', 'mark', 'fullscreen_mode', 'floating' }
+QUIET_WORKSPACE_CHANGES = { 'rename', 'urgent', 'move' }
+
 def sendBarMessage(inTail):
-    call([ 'polybar-msg', 'cmd', inTail ])
+    payload = inTail.encode()
+    message = struct.pack('=7sBIB', b'polyipc', 0, len(payload), 0) + payload
+    sent = False
+
+    try:
+        names = [ name for name in os.listdir(IPC_DIR) if name.endswith('.sock') ]
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as bar:
+                bar.settimeout(1)
+                bar.connect(os.path.join(IPC_DIR, name))
+                bar.sendall(message)
+                bar.recv(64)    # polybar replies once the command is handled
+            sent = True
+        except OSError:
+            pass                # Left behind by a bar that has exited
+
+    if not sent:
+        call([ 'polybar-msg', 'cmd', inTail ])  # Older polybar without the socket
+
+def flush():
+    global timer, lastSent
+
+    with lock:
+        timer = None
+
+    with sending:
+        with lock:
+            tail = wanted
+        if tail != lastSent:
+            sendBarMessage(tail)
+            lastSent = tail
+
+def showHide():
+    global wanted, timer
+
+    #   Only the state at the end of a burst is sent, and only if it changed
+    with lock:
+        wanted = 'hide' if windows.get(focused) else 'show'
+        if timer is None:
+            timer = Timer(DEBOUNCE, flush)
+            timer.daemon = True
+            timer.start()
+
+def forget(inWindow):
+    windows.get(workspaceOf.pop(inWindow, None), set()).discard(inWindow)
+
+def place(inWindow, inWorkspace):
+    forget(inWindow)
+    windows.setdefault(inWorkspace, set()).add(inWindow)
+    workspaceOf[inWindow] = inWorkspace
+
+def recount(inWorkspace):
+    #   Workspace events carry the workspace's whole subtree
+    for window in windows.pop(inWorkspace.id, set()):
+        workspaceOf.pop(window, None)
+    windows[inWorkspace.id] = set()
+    for leaf in inWorkspace.leaves():
+        place(leaf.id, inWorkspace.id)
+
+def resync():
+    global focused
+
+    tree = i3.get_tree()
+    windows.clear()
+    workspaceOf.clear()
+    for workspace in tree.workspaces():
+        recount(workspace)
+    current = tree.find_focused()
+    focused = current.workspace().id if current and current.workspace() else None
+
+def on_Window(self, e):
+    if e.change in QUIET_WINDOW_CHANGES:
+        return
+    if e.change in ('new', 'focus') or (e.change == 'move' and e.container.focused):
+        #   New windows open on the focused workspace, and the focused window
+        #   is on it (assignments move them away with a 'move' event)
+        place(e.container.id, focused)
+    elif e.change in ('close', 'move'):
+        #   A window moved off is counted again once its workspace is focused
+        forget(e.container.id)
+    else:
+        resync()
+
+    showHide()
+
+def on_Workspace(self, e):
+    global focused
 
-def on_ShowHide(self, e):
-    tail = 'hide' if len(i3.get_tree().find_focused().workspace().\
-            descendants()) > 0 else 'show'
+    if e.change in QUIET_WORKSPACE_CHANGES:
+        return
+    if e.change in ('focus', 'init'):
+        for workspace in (e.old, e.current):
+            if workspace:
+                recount(workspace)
+        if e.change == 'focus':
+            focused = e.current.id
+    elif e.change == 'empty':
+        recount(e.current)
+        windows.pop(e.current.id, None)
+    else:
+        resync()
 
-    sendBarMessage(tail)
+    showHide()
 
-i3.on('window', on_ShowHide)
-i3.on('workspace', on_ShowHide)
+i3.on('window', on_Window)
+i3.on('workspace', on_Workspace)
 
-on_ShowHide('', '')
+resync()
+showHide()
 
 i3.main()
 